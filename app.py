@@ -1,21 +1,119 @@
-from flask import Flask, request, jsonify, send_file, after_this_request
+from flask import Flask, Response, request, send_file, after_this_request
+from flask.json.provider import JSONProvider
 import librosa
 import numpy as np
+import numba
 import tempfile
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 import subprocess
 import shutil
 import re
-from basic_pitch.inference import predict
+import hashlib
+import gzip
+import heapq
+import threading
+import functools
+from urllib.parse import urlparse
+from basic_pitch.inference import predict, Model
 from basic_pitch import ICASSP_2022_MODEL_PATH
+from basic_pitch.constants import AUDIO_N_SAMPLES
 import pretty_midi
-from collections import defaultdict
-import json
+try:
+    import symusic  # C++ MIDI encoder - much faster than pretty_midi for writes
+except ImportError:
+    symusic = None
+import soundfile as sf
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 
 app = Flask(__name__)
 
+# Shared pool for overlapping network I/O with local work
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+# CPU-bound jobs (Basic Pitch inference, beat tracking) run here so a few
+# multi-second analyses never hold the EXECUTOR slots downloads wait on
+COMPUTE_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+# Separate small pool for disk writes/deletes so they never queue behind a
+# transcription on EXECUTOR
+IO_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+
+def _remove_path(path):
+    # Files are the common case - unlink straight away and only look
+    # closer when that fails (a directory, or already gone)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+def discard_path(path):
+    """Delete a temp file or directory in the background instead of before the response goes out"""
+    if path:
+        IO_EXECUTOR.submit(_remove_path, path)
+
+# Pooled HTTP client so repeat downloads from the same storage host (and the
+# Tonn polling loop) reuse connections instead of redoing the TLS handshake.
+# Retries are limited to GET/HEAD: urllib3's default list also includes PUT,
+# and replaying the Tonn upload or the POSTs must stay the caller's decision.
+HTTP_SESSION = requests.Session()
+_http_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=2, backoff_factor=0.2, allowed_methods=frozenset({'GET', 'HEAD'}))
+)
+HTTP_SESSION.mount('https://', _http_adapter)
+HTTP_SESSION.mount('http://', _http_adapter)
+
+def warm_up_librosa():
+    """Prime librosa's FFT plans and numba kernels so the first request doesn't pay for them"""
+    try:
+        librosa.stft(np.zeros(2048, dtype=np.float32))
+    except Exception as e:
+        print(f"Librosa warmup failed: {e}")
+
+_librosa_warmup = EXECUTOR.submit(warm_up_librosa)
+
+# Load the Basic Pitch model once per process - predict() otherwise
+# rebuilds it from disk on every call. BASIC_PITCH_MODEL_PATH can point at
+# an alternative serialization, e.g. the INT8/FP16 ONNX models built by
+# quantize_basic_pitch.py (requires onnxruntime)
+BASIC_PITCH_MODEL_PATH = os.environ.get('BASIC_PITCH_MODEL_PATH') or ICASSP_2022_MODEL_PATH
+
+def load_basic_pitch_model(model_path):
+    """Load a Basic Pitch model, moving ONNX models onto the GPU when one is available"""
+    model = Model(model_path)
+    if model.model_type == Model.MODEL_TYPES.ONNX:
+        # basic_pitch always opens ONNX sessions on the CPU provider
+        import onnxruntime as ort
+        if 'CUDAExecutionProvider' in ort.get_available_providers():
+            try:
+                model.model = ort.InferenceSession(
+                    str(model_path), providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
+                )
+            except Exception as e:
+                print(f"CUDA session failed, staying on CPU: {e}")
+    return model
+
+BASIC_PITCH_MODEL = load_basic_pitch_model(BASIC_PITCH_MODEL_PATH)
+
+def warm_up_basic_pitch():
+    """Run one silent window through the model so graph setup happens before the first request"""
+    try:
+        BASIC_PITCH_MODEL.predict(np.zeros((1, AUDIO_N_SAMPLES, 1), dtype=np.float32))
+    except Exception as e:
+        print(f"Basic Pitch warmup failed: {e}")
+
+EXECUTOR.submit(warm_up_basic_pitch)
+
 # =============================================================================
 # GENRE-SPECIFIC PRODUCTION TARGETS
 # =============================================================================
@@ -153,6 +251,87 @@ GENRE_TARGETS = {
     }
 }
 
+# Static tail of the feedback prompt - the response schema the model must fill
+AI_FEEDBACK_RESPONSE_FORMAT = """## Your Task:
+Provide feedback in this exact JSON format:
+{
+    "overall_rating": "EXCELLENT/GOOD/NEEDS_WORK/CONCERNING",
+    "genre_match_score": 1-10,
+    "headline": "One punchy sentence summary",
+    "loudness_feedback": {
+        "status": "PERFECT/TOO_LOUD/TOO_QUIET/ACCEPTABLE",
+        "message": "Specific feedback about loudness for this genre"
+    },
+    "stereo_feedback": {
+        "status": "PERFECT/TOO_WIDE/TOO_NARROW/ACCEPTABLE",
+        "message": "Feedback about stereo width and imaging"
+    },
+    "dynamics_feedback": {
+        "status": "PERFECT/OVER_COMPRESSED/TOO_DYNAMIC/ACCEPTABLE",
+        "message": "Feedback about dynamic range for this genre"
+    },
+    "technical_issues": ["List any technical problems"],
+    "strengths": ["List what's working well"],
+    "suggestions": ["3-5 actionable production tips specific to their genre"]
+}
+"""
+
+def find_json_object(text):
+    """
+    Span of the first balanced {...} object in text, or None
+    One linear pass that skips braces inside JSON strings
+    """
+    start = text.find('{')
+    if start < 0:
+        return None
+
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+def build_genre_prompt_fragments(targets):
+    """The (header, footer) of the feedback prompt for one genre's targets"""
+    header = f"""You are KOE, an expert AI music production mentor. Analyze this track and provide personalized feedback.
+
+## Artist's Genre: {targets['name']}
+Genre characteristics: {targets['characteristics']}
+Target LUFS range: {targets['lufs_target'][0]} to {targets['lufs_target'][1]} LUFS ({targets['lufs_description']})
+Clipping tolerance for this genre: {targets['clipping_tolerance']}
+Expected stereo width: {targets['stereo_width_target'][0]}-{targets['stereo_width_target'][1]}%
+Expected dynamic range: {targets['dynamic_range_target'][0]}-{targets['dynamic_range_target'][1]} dB
+
+"""
+    footer = f"""{AI_FEEDBACK_RESPONSE_FORMAT}
+Be encouraging but honest. Frame everything through the lens of {targets['name']} production standards. If something would be a problem in pop but is fine for their genre, say so!"""
+    return header, footer
+
+# genre -> (prompt header, prompt footer); only the metrics vary per call
+GENRE_PROMPT_FRAGMENTS = {genre: build_genre_prompt_fragments(targets) for genre, targets in GENRE_TARGETS.items()}
+
+@functools.lru_cache(maxsize=1)
+def get_anthropic_client(api_key):
+    """One Anthropic client per key, so its connection pool stays warm across requests"""
+    import anthropic  # Lazy import
+    return anthropic.Anthropic(api_key=api_key)
+
 def generate_ai_feedback(analysis_result, genre):
     """Generate AI-powered production feedback based on genre expectations"""
     try:
@@ -165,10 +344,10 @@ def generate_ai_feedback(analysis_result, genre):
         return {'skipped': 'ANTHROPIC_API_KEY not configured'}
 
     try:
-        client = anthropic.Anthropic(api_key=anthropic_key)
+        client = get_anthropic_client(anthropic_key)
 
-        # Get genre targets
-        targets = GENRE_TARGETS.get(genre, GENRE_TARGETS['other'])
+        # Genre-specific framing is constant per genre - prebuilt at import
+        prompt_header, prompt_footer = GENRE_PROMPT_FRAGMENTS.get(genre, GENRE_PROMPT_FRAGMENTS['other'])
 
         # Extract key metrics from analysis
         librosa_data = analysis_result.get('librosa', {})
@@ -190,16 +369,7 @@ def generate_ai_feedback(analysis_result, genre):
         clipping = technical.get('clipping', 'NONE')
         drc_rating = master_eval.get('drc', 'N/A')
 
-        prompt = f"""You are KOE, an expert AI music production mentor. Analyze this track and provide personalized feedback.
-
-## Artist's Genre: {targets['name']}
-Genre characteristics: {targets['characteristics']}
-Target LUFS range: {targets['lufs_target'][0]} to {targets['lufs_target'][1]} LUFS ({targets['lufs_description']})
-Clipping tolerance for this genre: {targets['clipping_tolerance']}
-Expected stereo width: {targets['stereo_width_target'][0]}-{targets['stereo_width_target'][1]}%
-Expected dynamic range: {targets['dynamic_range_target'][0]}-{targets['dynamic_range_target'][1]} dB
-
-## Track Analysis Results:
+        prompt = prompt_header + f"""## Track Analysis Results:
 - Tempo: {tempo} BPM
 - Key: {key}
 - Duration: {duration}s
@@ -212,30 +382,7 @@ Expected dynamic range: {targets['dynamic_range_target'][0]}-{targets['dynamic_r
 - Mono Compatible: {stereo.get('mono_compatible', 'N/A')}
 - Phase Issues: {stereo.get('phase_issues', 'N/A')}
 
-## Your Task:
-Provide feedback in this exact JSON format:
-{{
-    "overall_rating": "EXCELLENT/GOOD/NEEDS_WORK/CONCERNING",
-    "genre_match_score": 1-10,
-    "headline": "One punchy sentence summary",
-    "loudness_feedback": {{
-        "status": "PERFECT/TOO_LOUD/TOO_QUIET/ACCEPTABLE",
-        "message": "Specific feedback about loudness for this genre"
-    }},
-    "stereo_feedback": {{
-        "status": "PERFECT/TOO_WIDE/TOO_NARROW/ACCEPTABLE",
-        "message": "Feedback about stereo width and imaging"
-    }},
-    "dynamics_feedback": {{
-        "status": "PERFECT/OVER_COMPRESSED/TOO_DYNAMIC/ACCEPTABLE",
-        "message": "Feedback about dynamic range for this genre"
-    }},
-    "technical_issues": ["List any technical problems"],
-    "strengths": ["List what's working well"],
-    "suggestions": ["3-5 actionable production tips specific to their genre"]
-}}
-
-Be encouraging but honest. Frame everything through the lens of {targets['name']} production standards. If something would be a problem in pop but is fine for their genre, say so!"""
+""" + prompt_footer
 
         message = client.messages.create(
             model="claude-sonnet-4-20250514",
@@ -249,16 +396,16 @@ Be encouraging but honest. Frame everything through the lens of {targets['name']
         response_text = message.content[0].text
 
         # Try to extract JSON from the response
-        json_match = re.search(r'\{[\s\S]*\}', response_text)
-        if json_match:
-            feedback = json.loads(json_match.group())
+        json_text = find_json_object(response_text)
+        if json_text:
+            feedback = orjson.loads(json_text)
             return feedback
         else:
             return {'error': 'Failed to parse AI response', 'raw': response_text}
 
     except anthropic.APIError as e:
         return {'error': f'Anthropic API error: {str(e)}'}
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         return {'error': f'JSON parse error: {str(e)}', 'raw': response_text}
     except Exception as e:
         return {'error': f'AI feedback error: {str(e)}'}
@@ -267,44 +414,32 @@ Be encouraging but honest. Frame everything through the lens of {targets['name']
 # STREAMING PLATFORM EXTRACTION (yt-dlp)
 # =============================================================================
 
-STREAMING_PLATFORMS = [
-    'soundcloud.com',
-    'youtube.com',
-    'youtu.be',
-    'spotify.com',
-    'bandcamp.com',
-    'audiomack.com',
-    'tiktok.com',
-    'instagram.com',
-    'twitter.com',
-    'x.com'
-]
+# Domain -> friendly platform name
+STREAMING_PLATFORMS = {
+    'soundcloud.com': 'SoundCloud',
+    'youtube.com': 'YouTube',
+    'youtu.be': 'YouTube',
+    'spotify.com': 'Spotify',
+    'bandcamp.com': 'Bandcamp',
+    'audiomack.com': 'Audiomack',
+    'tiktok.com': 'TikTok',
+    'instagram.com': 'Instagram',
+    'twitter.com': 'Twitter/X',
+    'x.com': 'Twitter/X'
+}
+
+# One alternation over every domain, so a single scan of the URL answers
+# both is_streaming_url and get_platform_name
+STREAMING_PLATFORM_RE = re.compile('|'.join(re.escape(domain) for domain in STREAMING_PLATFORMS))
 
 def is_streaming_url(url):
     """Check if URL is from a supported streaming platform"""
-    lower_url = url.lower()
-    return any(platform in lower_url for platform in STREAMING_PLATFORMS)
+    return STREAMING_PLATFORM_RE.search(url.lower()) is not None
 
 def get_platform_name(url):
     """Get friendly name of streaming platform"""
-    lower_url = url.lower()
-    if 'soundcloud.com' in lower_url:
-        return 'SoundCloud'
-    elif 'youtube.com' in lower_url or 'youtu.be' in lower_url:
-        return 'YouTube'
-    elif 'spotify.com' in lower_url:
-        return 'Spotify'
-    elif 'bandcamp.com' in lower_url:
-        return 'Bandcamp'
-    elif 'audiomack.com' in lower_url:
-        return 'Audiomack'
-    elif 'tiktok.com' in lower_url:
-        return 'TikTok'
-    elif 'instagram.com' in lower_url:
-        return 'Instagram'
-    elif 'twitter.com' in lower_url or 'x.com' in lower_url:
-        return 'Twitter/X'
-    return 'Unknown'
+    match = STREAMING_PLATFORM_RE.search(url.lower())
+    return STREAMING_PLATFORMS[match.group()] if match else 'Unknown'
 
 def extract_audio_from_url(url, output_dir):
     """
@@ -315,13 +450,16 @@ def extract_audio_from_url(url, output_dir):
         # Create output path
         output_template = os.path.join(output_dir, 'audio.%(ext)s')
 
-        # yt-dlp command for audio extraction
+        # yt-dlp command for audio extraction - keep the platform's own
+        # audio stream rather than re-encoding to WAV (an ffmpeg pass and
+        # ~10x the bytes on disk); librosa and Tonn both take m4a/mp3
         cmd = [
             'yt-dlp',
             '--no-playlist',
-            '-x',  # Extract audio
-            '--audio-format', 'wav',  # Convert to WAV for analysis
-            '--audio-quality', '0',  # Best quality
+            '-f', 'bestaudio[ext=m4a]/bestaudio[ext=mp3]/bestaudio/best',
+            # Fetch HLS/DASH fragments in parallel - each one is RTT-bound
+            '--concurrent-fragments', '8',
+            '--no-mtime',
             '-o', output_template,
             '--no-warnings',
             '--quiet',
@@ -349,6 +487,128 @@ def extract_audio_from_url(url, output_dir):
     except Exception as e:
         return None, str(e)
 
+# =============================================================================
+# DIRECT AUDIO DOWNLOAD
+# =============================================================================
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+# Hard cap on downloaded audio so a bad link can't fill the disk or tie up
+# a worker streaming an endless body
+MAX_DOWNLOAD_BYTES = int(os.environ.get('MAX_DOWNLOAD_MB', 50)) * 1024 * 1024
+
+def download_audio_to_file(audio_url, suffix='.wav', timeout=30, dir=None):
+    """
+    Stream an audio URL straight into a temp file, capped at MAX_DOWNLOAD_BYTES
+    Returns path to the downloaded file (caller cleans up)
+    """
+    tmp_path = None
+    try:
+        # Audio is already compressed - ask for the raw bytes so no server
+        # gzips it on the fly
+        with HTTP_SESSION.get(audio_url, stream=True, timeout=timeout,
+                              headers={'Accept-Encoding': 'identity'}) as response:
+            if response.status_code != 200:
+                return None, f"HTTP {response.status_code}"
+
+            # Fail fast when the server tells us up front
+            content_length = response.headers.get('Content-Length')
+            if content_length and content_length.isdigit() and int(content_length) > MAX_DOWNLOAD_BYTES:
+                return None, f"File too large ({int(content_length) // (1024 * 1024)} MB, limit {MAX_DOWNLOAD_BYTES // (1024 * 1024)} MB)"
+
+            # Let urllib3 undo any transfer gzip while we copy
+            response.raw.decode_content = True
+
+            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=dir) as tmp_file:
+                tmp_path = tmp_file.name
+                # Content-Length can be missing or wrong, so count as we go
+                downloaded = 0
+                for chunk in iter(lambda: response.raw.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    downloaded += len(chunk)
+                    if downloaded > MAX_DOWNLOAD_BYTES:
+                        raise ValueError(f"File too large (limit {MAX_DOWNLOAD_BYTES // (1024 * 1024)} MB)")
+                    tmp_file.write(chunk)
+
+        return tmp_path, None
+
+    except Exception as e:
+        if tmp_path:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+        return None, str(e)
+
+# On-disk LRU of downloaded audio, keyed by URL, so re-analyzing the same
+# link on /analyze, /music-theory or /extract-chords-midi skips the download.
+# The file mtime is when it was downloaded and the atime when it was last
+# used: copies older than AUDIO_CACHE_TTL are fetched again (the content
+# behind a URL can change), and the least recently used files go once the
+# directory passes AUDIO_CACHE_MB
+AUDIO_CACHE_DIR = os.environ.get('AUDIO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'koe-cache'))
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get('AUDIO_CACHE_MB', 2048)) * 1024 * 1024
+AUDIO_CACHE_TTL = int(os.environ.get('AUDIO_CACHE_TTL', 3600))  # seconds
+_audio_cache_lock = threading.Lock()
+
+def evict_audio_cache():
+    """Drop least recently used cached audio until the cache fits AUDIO_CACHE_MAX_BYTES"""
+    with _audio_cache_lock:
+        entries = []
+        for entry in os.scandir(AUDIO_CACHE_DIR):
+            # .part files are downloads still in flight
+            if entry.is_file() and not entry.name.endswith('.part'):
+                stat = entry.stat()
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= AUDIO_CACHE_MAX_BYTES:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+# Extensions kept on downloaded files so decoders (and the Tonn upload's
+# content type) see the real container instead of everything posing as .wav
+AUDIO_SUFFIXES = ('.wav', '.mp3', '.flac', '.m4a', '.ogg', '.opus', '.webm')
+
+def audio_suffix(audio_url):
+    """File extension for an audio URL, taken from its path (.wav when unknown)"""
+    ext = os.path.splitext(urlparse(audio_url).path)[1].lower()
+    return ext if ext in AUDIO_SUFFIXES else '.wav'
+
+def fetch_audio(audio_url, suffix=None):
+    """
+    Local copy of an audio URL, downloaded on first use and then served from
+    the on-disk cache. Returns (path, error); the file belongs to the cache,
+    so callers must not delete it
+    """
+    if suffix is None:
+        suffix = audio_suffix(audio_url)
+    os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
+    cache_path = os.path.join(AUDIO_CACHE_DIR, hashlib.sha256(audio_url.encode()).hexdigest() + suffix)
+
+    try:
+        stat = os.stat(cache_path)
+        if time.time() - stat.st_mtime < AUDIO_CACHE_TTL:
+            # Hit - mark as recently used, keeping the download time
+            os.utime(cache_path, (time.time(), stat.st_mtime))
+            return cache_path, None
+    except FileNotFoundError:
+        pass
+
+    # Download beside the cache and rename in, so concurrent requests for
+    # the same URL never see a partial file
+    tmp_path, error = download_audio_to_file(audio_url, suffix='.part', dir=AUDIO_CACHE_DIR)
+    if error:
+        return None, error
+    os.replace(tmp_path, cache_path)
+
+    IO_EXECUTOR.submit(evict_audio_cache)
+    return cache_path, None
+
 # =============================================================================
 # TONN API INTEGRATION (Mix Analysis)
 # =============================================================================
@@ -386,15 +646,36 @@ GENRE_TO_STYLE = {
     'dance': 'POP'
 }
 
+# Every genre keyword found in one C-level scan. The lookahead reports a
+# match at each position (keywords may overlap); where several start at the
+# same spot the alternation takes the earliest in dict order, so the
+# lowest-priority-index hit overall is the first key the old loop would match
+GENRE_KEYWORD_RE = re.compile('(?=(' + '|'.join(re.escape(key) for key in GENRE_TO_STYLE) + '))')
+GENRE_KEYWORD_PRIORITY = {key: i for i, key in enumerate(GENRE_TO_STYLE)}
+
+def scan_genre_style(genre):
+    """Tonn style for the highest-priority genre keyword in a lowercased genre"""
+    keywords = [match.group(1) for match in GENRE_KEYWORD_RE.finditer(genre)]
+    if not keywords:
+        return 'ELECTRONIC'
+    return GENRE_TO_STYLE[min(keywords, key=GENRE_KEYWORD_PRIORITY.__getitem__)]
+
+# Most requests send one of our own genre slugs or a bare keyword, so their
+# answers are worked out once here (with the same scan, so results match)
+GENRE_STYLE_EXACT = {
+    genre: scan_genre_style(genre)
+    for genre in (*GENRE_TARGETS, *GENRE_TO_STYLE)
+}
+
 def map_genre_to_style(genre):
     """Map user genre to Tonn musical style"""
     if not genre:
         return 'ELECTRONIC'
-    lower = genre.lower()
-    for key, style in GENRE_TO_STYLE.items():
-        if key in lower:
-            return style
-    return 'ELECTRONIC'
+    genre = genre.lower()
+    style = GENRE_STYLE_EXACT.get(genre.strip())
+    if style is not None:
+        return style
+    return scan_genre_style(genre)
 
 def upload_to_tonn(audio_path, api_key):
     """Upload audio file to Tonn and get readable URL"""
@@ -407,12 +688,15 @@ def upload_to_tonn(audio_path, api_key):
             '.wav': 'audio/wav',
             '.mp3': 'audio/mpeg',
             '.flac': 'audio/flac',
-            '.m4a': 'audio/mp4'
+            '.m4a': 'audio/mp4',
+            '.ogg': 'audio/ogg',
+            '.opus': 'audio/ogg',
+            '.webm': 'audio/webm'
         }
         content_type = content_types.get(ext, 'audio/wav')
 
         # Step 1: Get upload URLs
-        response = requests.post(
+        response = HTTP_SESSION.post(
             f'{TONN_API_BASE}/upload',
             headers={
                 'Content-Type': 'application/json',
@@ -425,23 +709,26 @@ def upload_to_tonn(audio_path, api_key):
         if response.status_code != 200:
             return None, f"Failed to get upload URL: {response.text}"
 
-        data = response.json()
+        data = orjson.loads(response.content)
         signed_url = data.get('signed_url')
         readable_url = data.get('readable_url')
 
         if not signed_url or not readable_url:
             return None, "Missing URLs in Tonn response"
 
-        # Step 2: Upload file to signed URL
+        # Step 2: Upload file to signed URL, streamed from disk. An explicit
+        # Content-Length keeps requests from falling back to chunked
+        # encoding, which signed-URL storage backends tend to reject
         with open(audio_path, 'rb') as f:
-            audio_data = f.read()
-
-        put_response = requests.put(
-            signed_url,
-            headers={'Content-Type': content_type},
-            data=audio_data,
-            timeout=60
-        )
+            put_response = HTTP_SESSION.put(
+                signed_url,
+                headers={
+                    'Content-Type': content_type,
+                    'Content-Length': str(os.fstat(f.fileno()).st_size)
+                },
+                data=f,
+                timeout=60
+            )
 
         if put_response.status_code not in [200, 201]:
             return None, f"Failed to upload to Tonn: {put_response.status_code}"
@@ -451,44 +738,52 @@ def upload_to_tonn(audio_path, api_key):
     except Exception as e:
         return None, str(e)
 
+# Tonn polling: start quick so fast results come back early, back off
+# towards TONN_POLL_MAX_DELAY, and give up after TONN_POLL_TIMEOUT seconds
+TONN_POLL_INITIAL_DELAY = 1.0
+TONN_POLL_MAX_DELAY = 8.0
+TONN_POLL_TIMEOUT = 150
+
 def analyze_with_tonn(readable_url, musical_style, is_master, api_key):
     """Run Tonn mix analysis with polling"""
     try:
-        payload = {
+        # Encoded once and re-sent as-is on every poll
+        body = orjson.dumps({
             'mixDiagnosisData': {
                 'audioFileLocation': readable_url,
                 'musicalStyle': musical_style,
                 'isMaster': is_master
             }
+        })
+        headers = {
+            'Content-Type': 'application/json',
+            'x-api-key': api_key
         }
 
-        response = requests.post(
+        response = HTTP_SESSION.post(
             f'{TONN_API_BASE}/mixanalysis',
-            headers={
-                'Content-Type': 'application/json',
-                'x-api-key': api_key
-            },
-            json=payload,
+            headers=headers,
+            data=body,
             timeout=30
         )
 
         # Handle async processing
         if response.status_code == 202:
-            # Poll for results
-            for attempt in range(30):  # Max 2.5 minutes
-                time.sleep(5)
-                poll_response = requests.post(
+            # Poll for results with exponential backoff
+            deadline = time.monotonic() + TONN_POLL_TIMEOUT
+            delay = TONN_POLL_INITIAL_DELAY
+            while time.monotonic() + delay < deadline:
+                time.sleep(delay)
+                delay = min(delay * 1.5, TONN_POLL_MAX_DELAY)
+                poll_response = HTTP_SESSION.post(
                     f'{TONN_API_BASE}/mixanalysis',
-                    headers={
-                        'Content-Type': 'application/json',
-                        'x-api-key': api_key
-                    },
-                    json=payload,
+                    headers=headers,
+                    data=body,
                     timeout=30
                 )
 
                 if poll_response.status_code == 200:
-                    data = poll_response.json()
+                    data = orjson.loads(poll_response.content)
                     if data.get('mixDiagnosisResults'):
                         return data, None
 
@@ -497,11 +792,20 @@ def analyze_with_tonn(readable_url, musical_style, is_master, api_key):
         if response.status_code != 200:
             return None, f"Tonn analysis failed: {response.text}"
 
-        return response.json(), None
+        return orjson.loads(response.content), None
 
     except Exception as e:
         return None, str(e)
 
+# Approximate width (%) for Tonn's stereo_field labels, checked in order so
+# 'very wide' is seen before the plain 'wide' it contains
+STEREO_FIELD_WIDTHS = {
+    'mono': 0,
+    'narrow': 25,
+    'very wide': 90,
+    'wide': 75,
+}
+
 def normalize_tonn_response(tonn_data):
     """Normalize Tonn API response to our format"""
     result = {}
@@ -521,15 +825,8 @@ def normalize_tonn_response(tonn_data):
 
     # Stereo field
     stereo_field = payload.get('stereo_field', '')
-    width = 50  # Default
-    if 'mono' in stereo_field.lower():
-        width = 0
-    elif 'narrow' in stereo_field.lower():
-        width = 25
-    elif 'wide' in stereo_field.lower():
-        width = 75
-    elif 'very wide' in stereo_field.lower():
-        width = 90
+    field = (stereo_field or '').lower().replace('_', ' ')
+    width = next((w for keyword, w in STEREO_FIELD_WIDTHS.items() if keyword in field), 50)
 
     result['stereo'] = {
         'width': width,
@@ -594,37 +891,191 @@ def normalize_tonn_response(tonn_data):
 
     return result
 
-# Custom JSON encoder to handle numpy types
-class NumpyEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        elif isinstance(obj, np.floating):
-            return float(obj)
-        elif isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return super(NumpyEncoder, self).default(obj)
-
-app.json_encoder = NumpyEncoder
-
-# Helper function to convert numpy types recursively
-def convert_numpy_types(obj):
-    if isinstance(obj, dict):
-        return {key: convert_numpy_types(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_numpy_types(item) for item in obj]
-    elif isinstance(obj, np.integer):
-        return int(obj)
-    elif isinstance(obj, np.floating):
-        return float(obj)
-    elif isinstance(obj, np.ndarray):
+# Tonn uploads and polls spend minutes waiting on the network; they get
+# their own pool so they never hold EXECUTOR slots needed for downloads
+TONN_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+def run_tonn_analysis(audio_path, genre, is_master, api_key):
+    """Upload to Tonn, run the mix analysis and normalize it - errors come back in the result"""
+    try:
+        # Upload to Tonn
+        readable_url, upload_error = upload_to_tonn(audio_path, api_key)
+        if upload_error:
+            return {'error': f'Tonn upload failed: {upload_error}'}
+
+        # Run analysis
+        musical_style = map_genre_to_style(genre)
+        tonn_data, analysis_error = analyze_with_tonn(
+            readable_url, musical_style, is_master, api_key
+        )
+        if analysis_error:
+            return {'error': f'Tonn analysis failed: {analysis_error}'}
+        return normalize_tonn_response(tonn_data)
+
+    except Exception as e:
+        return {'error': f'Tonn analysis error: {str(e)}'}
+
+# orjson serializes numpy scalars and contiguous arrays natively; anything
+# else (e.g. strided array views) falls back to plain Python values
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def _orjson_default(obj):
+    if isinstance(obj, np.ndarray):
         return obj.tolist()
-    else:
-        return obj
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError
+
+def encode_json(data):
+    """Serialize a result dict (numpy values included) to JSON bytes"""
+    return orjson.dumps(data, default=_orjson_default, option=ORJSON_OPTIONS)
+
+class ORJSONProvider(JSONProvider):
+    """Route Flask's own JSON handling (request.get_json, jsonify) through orjson too"""
+
+    def dumps(self, obj, **kwargs):
+        return encode_json(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app.json = ORJSONProvider(app)
+
+# Chord/note lists repeat the same names over and over, so gzip shrinks
+# large responses several times over; tiny bodies aren't worth the CPU
+JSON_GZIP_MIN_BYTES = 1024
+JSON_GZIP_LEVEL = 6
+
+def json_response(data, status=200):
+    """JSON response via orjson - pass bytes to send pre-encoded JSON as-is"""
+    body = data if isinstance(data, bytes) else encode_json(data)
+    response = Response(body, status=status, mimetype='application/json')
+    if len(body) >= JSON_GZIP_MIN_BYTES:
+        response.vary.add('Accept-Encoding')
+        if request.accept_encodings['gzip']:
+            response.set_data(gzip.compress(body, compresslevel=JSON_GZIP_LEVEL))
+            response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# =============================================================================
+# ANALYSIS RESULT CACHE
+# =============================================================================
+
+ANALYSIS_CACHE_SIZE = 256
+
+# audio hash -> encoded JSON bytes (immutable, and hits are served without
+# re-serializing)
+_analysis_cache = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+def hash_audio_file(file_path):
+    """BLAKE2b digest of an audio file's bytes, used as the cache key"""
+    with open(file_path, 'rb', buffering=0) as f:
+        if hasattr(hashlib, 'file_digest'):  # Python 3.11+
+            return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+        
+        # Read into one reused buffer rather than a new bytes object per
+        # chunk; hashlib drops the GIL while it digests each block
+        digest = hashlib.blake2b(digest_size=16)
+        buffer = bytearray(DOWNLOAD_CHUNK_SIZE)
+        view = memoryview(buffer)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+def get_cached_analysis(audio_hash):
+    """Return a cached analysis result as JSON bytes, or None on miss"""
+    with _analysis_cache_lock:
+        cached = _analysis_cache.get(audio_hash)
+        if cached is not None:
+            _analysis_cache.move_to_end(audio_hash)
+    return cached
+
+def store_cached_analysis(audio_hash, encoded):
+    """Store encoded analysis JSON, evicting the least recently used entry when full"""
+    with _analysis_cache_lock:
+        _analysis_cache[audio_hash] = encoded
+        _analysis_cache.move_to_end(audio_hash)
+        while len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+
+# audio_url -> (audio hash, expiry). Lets a repeat request for a URL we've
+# just analyzed skip the download; the TTL bounds how stale it can get if
+# the content behind the URL changes
+URL_HASH_TTL = 600  # seconds
+_url_hashes = OrderedDict()
+_url_hashes_lock = threading.Lock()
+
+def lookup_url_hash(audio_url):
+    """Return the audio hash last seen at a URL, or None if unknown/expired"""
+    with _url_hashes_lock:
+        entry = _url_hashes.get(audio_url)
+        if entry is None:
+            return None
+        audio_hash, expires = entry
+        if expires < time.time():
+            del _url_hashes[audio_url]
+            return None
+        return audio_hash
+
+def remember_url_hash(audio_url, audio_hash):
+    """Record which audio a URL served"""
+    with _url_hashes_lock:
+        _url_hashes[audio_url] = (audio_hash, time.time() + URL_HASH_TTL)
+        _url_hashes.move_to_end(audio_url)
+        while len(_url_hashes) > ANALYSIS_CACHE_SIZE:
+            _url_hashes.popitem(last=False)
+
+# =============================================================================
+# BASIC PITCH TRANSCRIPTION CACHE
+# =============================================================================
+
+# Model inference dominates every Basic Pitch endpoint, and /analyze,
+# /music-theory and /extract-chords-midi are often called on the same track
+TRANSCRIPTION_CACHE_SIZE = 32
+
+# (audio hash, seconds transcribed) -> PrettyMIDI (treated as read-only)
+_transcription_cache = OrderedDict()
+_transcription_cache_lock = threading.Lock()
+
+def transcribe_audio(file_path, audio_hash=None, max_seconds=None):
+    """
+    Basic Pitch MIDI transcription of an audio file, cached by content hash
+    Only the first max_seconds are transcribed when set
+    """
+    if audio_hash is None:
+        audio_hash = hash_audio_file(file_path)
+    cache_key = (audio_hash, max_seconds)
+
+    with _transcription_cache_lock:
+        midi_data = _transcription_cache.get(cache_key)
+        if midi_data is not None:
+            _transcription_cache.move_to_end(cache_key)
+            return midi_data
+
+    trimmed_path = trim_audio_file(file_path, max_seconds)
+    try:
+        model_output, midi_data, note_events = predict(trimmed_path or file_path, BASIC_PITCH_MODEL)
+    finally:
+        if trimmed_path:
+            try:
+                os.unlink(trimmed_path)
+            except OSError:
+                pass
+
+    with _transcription_cache_lock:
+        _transcription_cache[cache_key] = midi_data
+        _transcription_cache.move_to_end(cache_key)
+        while len(_transcription_cache) > TRANSCRIPTION_CACHE_SIZE:
+            _transcription_cache.popitem(last=False)
+    return midi_data
 
 @app.route('/', methods=['GET'])
 def health_check():
-    return jsonify({
+    return json_response({
         "status": "KOE Audio Analysis API is running!",
         "version": "2.0",
         "endpoints": {
@@ -638,127 +1089,226 @@ def health_check():
 
 @app.route('/analyze', methods=['POST'])
 def analyze_audio():
-    tmp_path = None
     try:
         # Check API key
         api_key = request.headers.get('X-API-Key')
         expected_key = os.environ.get('LIBROSA_API_KEY')
 
         if not expected_key:
-            return jsonify({'error': 'API key not configured on server'}), 500
+            return json_response({'error': 'API key not configured on server'}, 500)
 
         if not api_key or api_key != expected_key:
-            return jsonify({'error': 'Invalid or missing API key'}), 401
+            return json_response({'error': 'Invalid or missing API key'}, 401)
 
         data = request.get_json()
         audio_url = data.get('audio_url')
 
         if not audio_url:
-            return jsonify({'error': 'No audio_url provided'}), 400
-
-        # Download audio
-        response = requests.get(audio_url, timeout=30)
-        if response.status_code != 200:
-            return jsonify({'error': 'Failed to download audio file'}), 400
-
-        # Save temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
-            tmp_file.write(response.content)
-            tmp_path = tmp_file.name
-
-        # Analyze
-        result = analyze_audio_comprehensive(tmp_path)
-
-        # Convert numpy types to JSON-serializable types
-        result = convert_numpy_types(result)
-        return jsonify(result)
+            return json_response({'error': 'No audio_url provided'}, 400)
+
+        # A URL we analyzed recently can be answered without downloading it
+        known_hash = lookup_url_hash(audio_url)
+        if known_hash:
+            cached = get_cached_analysis(known_hash)
+            if cached is not None:
+                return json_response(cached)
+
+        # Fetch to disk (Basic Pitch needs a file path) while librosa
+        # finishes warming up on this thread
+        download_future = EXECUTOR.submit(fetch_audio, audio_url)
+        _librosa_warmup.result()
+        audio_path, download_error = download_future.result()
+        if download_error:
+            return json_response({'error': 'Failed to download audio file', 'details': download_error}, 400)
+
+        # Identical audio (e.g. a frontend re-polling) skips the analysis
+        audio_hash = hash_audio_file(audio_path)
+        remember_url_hash(audio_url, audio_hash)
+        cached = get_cached_analysis(audio_hash)
+        if cached is not None:
+            return json_response(cached)
+
+        # Analyze - orjson encodes the numpy values directly
+        result = analyze_audio_comprehensive(audio_path, audio_hash)
+        encoded = encode_json(result)
+        store_cached_analysis(audio_hash, encoded)
+        return json_response(encoded)
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        # Always cleanup temp file
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
+        return json_response({'error': str(e)}, 500)
 
 @app.route('/music-theory', methods=['POST'])
 def analyze_music_theory():
     """Dedicated endpoint for Basic Pitch music theory analysis"""
-    tmp_path = None  # Track file for cleanup
     try:
         # Check API key
         api_key = request.headers.get('X-API-Key')
         expected_key = os.environ.get('LIBROSA_API_KEY')
 
         if not expected_key:
-            return jsonify({'error': 'API key not configured on server'}), 500
+            return json_response({'error': 'API key not configured on server'}, 500)
 
         if not api_key or api_key != expected_key:
-            return jsonify({'error': 'Invalid or missing API key'}), 401
+            return json_response({'error': 'Invalid or missing API key'}, 401)
 
         data = request.get_json()
         audio_url = data.get('audio_url')
 
         if not audio_url:
-            return jsonify({'error': 'No audio_url provided'}), 400
-
-        # Download audio
-        response = requests.get(audio_url, timeout=30)
-        if response.status_code != 200:
-            return jsonify({'error': 'Failed to download audio file'}), 400
+            return json_response({'error': 'No audio_url provided'}, 400)
 
-        # Save temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
-            tmp_file.write(response.content)
-            tmp_path = tmp_file.name
+        # Stream download to disk (size-capped, cached by URL)
+        audio_path, download_error = fetch_audio(audio_url)
+        if download_error:
+            return json_response({'error': 'Failed to download audio file', 'details': download_error}, 400)
 
         # Analyze with Basic Pitch only
-        result = analyze_basic_pitch(tmp_path)
-
-        # Convert numpy types to JSON-serializable types
-        result = convert_numpy_types(result)
-        return jsonify(result)
+        result = analyze_basic_pitch(audio_path)
+        return json_response(result)
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        # Always cleanup temp file
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
+        return json_response({'error': str(e)}, 500)
+
+# Chroma, key, harmonic balance and beat tracking all live well below 5.5 kHz,
+# so /analyze works at half the usual rate. n_fft and hop are halved too,
+# which keeps the same frequency resolution and frame rate as 2048/512 at
+# 22.05 kHz for half the FFT work.
+ANALYSIS_SR = 11025
+ANALYSIS_N_FFT = 1024
+ANALYSIS_HOP_LENGTH = 256
+
+# Tempo, key and note statistics settle well within the first minute, so
+# long tracks are only analyzed up to this point (0 disables the cap)
+ANALYSIS_MAX_SECONDS = float(os.environ.get('KOE_MAX_SEC', 60)) or None
+
+# soxr's medium-quality preset: cheaper than librosa's default soxr_hq with
+# near-identical features (soxr_qq/lq alias enough to move the centroid)
+LOAD_RES_TYPE = 'soxr_mq'
+
+# Decoded audio, keyed by file identity and decode settings. /analyze,
+# /music-theory and /extract-chords-midi often decode the same cached
+# download at the same rate; arrays are shared, so they're made read-only
+DECODED_AUDIO_CACHE_SIZE = 8
+_decoded_audio = OrderedDict()
+_decoded_audio_lock = threading.Lock()
+
+def load_audio(file_path, sr, duration=None):
+    """
+    Decode audio as mono float32 at sr (first `duration` seconds if set)
+    Recently decoded files are served from memory; the array is read-only
+    """
+    try:
+        stat = os.stat(file_path)
+        cache_key = (file_path, stat.st_mtime_ns, stat.st_size, sr, duration)
+    except OSError:
+        cache_key = None
+
+    if cache_key is not None:
+        with _decoded_audio_lock:
+            cached = _decoded_audio.get(cache_key)
+            if cached is not None:
+                _decoded_audio.move_to_end(cache_key)
+                return cached
+
+    decoded = decode_audio(file_path, sr, duration)
+    decoded[0].setflags(write=False)
+
+    if cache_key is not None:
+        with _decoded_audio_lock:
+            _decoded_audio[cache_key] = decoded
+            _decoded_audio.move_to_end(cache_key)
+            while len(_decoded_audio) > DECODED_AUDIO_CACHE_SIZE:
+                _decoded_audio.popitem(last=False)
+    return decoded
+
+def decode_audio(file_path, sr, duration=None):
+    """
+    Decode audio as mono float32 at sr (first `duration` seconds if set)
+    Files already at sr are read straight through soundfile, skipping the resampler
+    """
+    try:
+        info = sf.info(file_path)
+    except Exception:
+        info = None
+
+    if info is not None and info.samplerate == sr:
+        frames = int(duration * sr) if duration else -1
+        y, _ = sf.read(file_path, frames=frames, dtype='float32', always_2d=True)
+        return np.ascontiguousarray(y.mean(axis=1) if y.shape[1] > 1 else y[:, 0]), sr
 
-def analyze_audio_comprehensive(file_path):
+    return librosa.load(file_path, sr=sr, mono=True, dtype=np.float32, duration=duration,
+                        res_type=LOAD_RES_TYPE)
+
+def trim_audio_file(file_path, max_seconds):
+    """
+    Write the first max_seconds of an audio file to a temp WAV
+    Returns the temp path (caller cleans up), or None if no trim is needed
+    """
+    if not max_seconds or librosa.get_duration(path=file_path) <= max_seconds:
+        return None
+
+    y, sr = librosa.load(file_path, sr=None, mono=True, duration=max_seconds, dtype=np.float32)
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
+        trimmed_path = tmp_file.name
+    sf.write(trimmed_path, y, sr, subtype='FLOAT')
+    return trimmed_path
+
+def track_beats(S, sr):
+    """Beat tracking on an onset envelope built from an existing magnitude spectrogram"""
+    mel_db = librosa.power_to_db(librosa.feature.melspectrogram(S=S**2, sr=sr))
+    onset_env = librosa.onset.onset_strength(S=mel_db, sr=sr)
+    return librosa.beat.beat_track(onset_envelope=onset_env, sr=sr, hop_length=ANALYSIS_HOP_LENGTH)
+
+def analyze_audio_comprehensive(file_path, audio_hash=None):
     """Comprehensive musical analysis using librosa"""
     
-    # Load audio with optimal settings
-    y, sr = librosa.load(file_path, sr=22050)
-    duration = librosa.get_duration(y=y, sr=sr)
+    # Basic Pitch has no data dependency on the librosa features below, so
+    # run its model inference alongside them
+    basic_pitch_future = COMPUTE_EXECUTOR.submit(analyze_basic_pitch, file_path, audio_hash)
     
-    # Tempo and beat analysis
-    tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-    beat_times = librosa.frames_to_time(beats, sr=sr)
+    # Load audio at the reduced analysis rate (Basic Pitch loads its own copy),
+    # capped to the analysis window
+    y, sr = load_audio(file_path, ANALYSIS_SR, ANALYSIS_MAX_SECONDS)
+    analyzed_duration = librosa.get_duration(y=y, sr=sr)
+    if ANALYSIS_MAX_SECONDS and analyzed_duration >= ANALYSIS_MAX_SECONDS:
+        # Truncated - report the full track length from the file itself
+        duration = librosa.get_duration(path=file_path)
+    else:
+        duration = analyzed_duration
+    
+    # One single-precision STFT shared by every spectral feature below
+    D = librosa.stft(y, n_fft=ANALYSIS_N_FFT, hop_length=ANALYSIS_HOP_LENGTH, dtype=np.complex64)
+    S = np.abs(D)
+    
+    # Tempo and beat analysis - the onset envelope comes from the same
+    # spectrogram, and tracking overlaps the features below
+    beat_future = COMPUTE_EXECUTOR.submit(track_beats, S, sr)
     
     # Key and harmonic analysis
-    chroma = librosa.feature.chroma_stft(y=y, sr=sr)
+    chroma = librosa.feature.chroma_stft(S=S**2, sr=sr)
     key_profile = np.mean(chroma, axis=1)
     dominant_notes = get_dominant_notes(key_profile)
     estimated_key = estimate_key(key_profile)
     
-    # Harmonic vs percussive separation
-    y_harmonic, y_percussive = librosa.effects.hpss(y)
-    harmonic_energy = np.mean(librosa.feature.rms(y=y_harmonic))
-    percussive_energy = np.mean(librosa.feature.rms(y=y_percussive))
-    energy_balance = harmonic_energy / (harmonic_energy + percussive_energy)
+    # Harmonic vs percussive balance, approximated from spectral flatness
+    # instead of a full HPSS (median filtering the whole spectrogram twice).
+    # Flatness is ~1 for noise-like/percussive frames and ~0 for tonal ones,
+    # so the overall RMS is split between the two in that proportion
+    flatness = float(np.mean(librosa.feature.spectral_flatness(S=S)))
+    total_energy = float(np.mean(librosa.feature.rms(S=S, frame_length=ANALYSIS_N_FFT)))
+    energy_balance = 1.0 - flatness
+    harmonic_energy = energy_balance * total_energy
+    percussive_energy = flatness * total_energy
     
     # Spectral analysis
-    spectral_centroids = librosa.feature.spectral_centroid(y=y, sr=sr)
+    spectral_centroids = librosa.feature.spectral_centroid(S=S, sr=sr)
+    
+    tempo, beats = beat_future.result()
+    # Only the first 10 beat times are reported, so only convert those
+    beat_times = librosa.frames_to_time(beats[:10], sr=sr, hop_length=ANALYSIS_HOP_LENGTH)
     
     # Basic Pitch analysis for music theory insights
-    basic_pitch_analysis = analyze_basic_pitch(file_path)
+    basic_pitch_analysis = basic_pitch_future.result()
     
     return {
         "duration": round(duration, 2),
@@ -774,108 +1324,135 @@ def analyze_audio_comprehensive(file_path):
         "brightness": {
             "average": round(float(np.mean(spectral_centroids)), 1)
         },
+        "analysis_sample_rate": sr,
+        "analyzed_duration": round(analyzed_duration, 2),
         "beat_count": len(beats),
-        "beat_times": beat_times[:10].tolist(),  # First 10 beats
+        "beat_times": beat_times,  # First 10 beats
         "music_theory": basic_pitch_analysis
     }
 
+PITCH_CLASSES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+
+# MIDI note number -> name (e.g. 60 -> 'C4'), built once instead of per note
+NOTE_NAMES = tuple(pretty_midi.note_number_to_name(i) for i in range(128))
+
+# Major and minor key templates
+MAJOR_TEMPLATE = np.array([1, 0, 1, 0, 1, 1, 0, 1, 0, 1, 0, 1])
+MINOR_TEMPLATE = np.array([1, 0, 1, 1, 0, 1, 0, 1, 1, 0, 1, 0])
+
+# All 24 keys interleaved (C major, C minor, C# major, ...) so argmax breaks
+# ties in the same order the original per-key loop did
+KEY_LABELS = [f"{note} {mode}" for note in PITCH_CLASSES for mode in ('major', 'minor')]
+KEY_TEMPLATES = np.stack([
+    np.roll(template, i)
+    for i in range(12)
+    for template in (MAJOR_TEMPLATE, MINOR_TEMPLATE)
+]).astype(np.float64)
+KEY_TEMPLATES_Z = (
+    (KEY_TEMPLATES - KEY_TEMPLATES.mean(axis=1, keepdims=True))
+    / KEY_TEMPLATES.std(axis=1, keepdims=True)
+)
+
 def get_dominant_notes(key_profile):
     """Convert chroma values to note names"""
-    notes = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-    top_indices = np.argsort(key_profile)[-3:][::-1]
-    return [notes[i] for i in top_indices]
+    # Only the top 3 are needed - partition, then order just those
+    top_indices = np.argpartition(key_profile, -3)[-3:]
+    top_indices = top_indices[np.argsort(-key_profile[top_indices])]
+    return [PITCH_CLASSES[i] for i in top_indices]
 
 def estimate_key(key_profile):
     """Simple key estimation based on chroma profile"""
-    notes = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-    
-    # Major and minor key templates
-    major_template = np.array([1, 0, 1, 0, 1, 1, 0, 1, 0, 1, 0, 1])
-    minor_template = np.array([1, 0, 1, 1, 0, 1, 0, 1, 1, 0, 1, 0])
-    
-    best_correlation = -1
-    best_key = "Unknown"
-    
-    for i in range(12):
-        # Test major
-        major_shifted = np.roll(major_template, i)
-        correlation = np.corrcoef(key_profile, major_shifted)[0,1]
-        if correlation > best_correlation:
-            best_correlation = correlation
-            best_key = f"{notes[i]} major"
-        
-        # Test minor  
-        minor_shifted = np.roll(minor_template, i)
-        correlation = np.corrcoef(key_profile, minor_shifted)[0,1]
-        if correlation > best_correlation:
-            best_correlation = correlation
-            best_key = f"{notes[i]} minor"
-    
-    return best_key
+    spread = np.std(key_profile)
+    if not spread > 0:
+        return "Unknown"
+
+    # Pearson correlation against all 24 templates in one matrix-vector product
+    profile_z = (key_profile - np.mean(key_profile)) / spread
+    correlations = KEY_TEMPLATES_Z @ profile_z / len(profile_z)
+
+    return KEY_LABELS[int(np.argmax(correlations))]
 
-def analyze_basic_pitch(file_path):
+def analyze_basic_pitch(file_path, audio_hash=None):
     """Analyze audio using Basic Pitch for music theory insights"""
     try:
-        # Try Basic Pitch prediction
-        model_output, midi_data, note_events = predict(file_path)
+        # Try Basic Pitch prediction - time scales with length, so only the
+        # analysis window of long tracks is transcribed
+        midi_data = transcribe_audio(file_path, audio_hash, ANALYSIS_MAX_SECONDS)
         
-        # Extract notes from MIDI data
-        notes = []
+        # Collect notes as parallel arrays - per-note dicts are only built
+        # for the notes that actually end up in the response
+        pitches, starts, ends, velocities = [], [], [], []
         for instrument in midi_data.instruments:
             for note in instrument.notes:
-                notes.append({
-                    'pitch': note.pitch,
-                    'note_name': pretty_midi.note_number_to_name(note.pitch),
-                    'start': round(note.start, 3),
-                    'end': round(note.end, 3),
-                    'duration': round(note.end - note.start, 3),
-                    'velocity': note.velocity
-                })
-        
-        # Sort notes by start time
-        notes.sort(key=lambda x: x['start'])
+                pitches.append(note.pitch)
+                starts.append(note.start)
+                ends.append(note.end)
+                velocities.append(note.velocity)
         
         # Analyze note statistics
-        if notes:
-            pitches = [note['pitch'] for note in notes]
-            durations = [note['duration'] for note in notes]
+        if pitches:
+            raw_starts = np.asarray(starts, dtype=np.float64)
+            raw_ends = np.asarray(ends, dtype=np.float64)
             
-            # Find most common notes
-            pitch_counts = {}
-            for pitch in pitches:
-                note_name = pretty_midi.note_number_to_name(pitch)
-                pitch_counts[note_name] = pitch_counts.get(note_name, 0) + 1
+            # Sort notes by start time
+            order = np.argsort(np.round(raw_starts, 3), kind='stable')
+            pitch_array = np.asarray(pitches, dtype=np.int64)[order]
+            start_times = np.round(raw_starts, 3)[order]
+            end_times = np.round(raw_ends, 3)[order]
+            durations = np.round(raw_ends - raw_starts, 3)[order]
             
-            most_common_notes = sorted(pitch_counts.items(), key=lambda x: x[1], reverse=True)[:5]
+            # Find most common notes - MIDI pitches are small ints, so tally
+            # with bincount and break ties by first appearance
+            pitch_counts = np.bincount(pitch_array, minlength=128)
+            unique_pitches, first_seen = np.unique(pitch_array, return_index=True)
+            top = np.lexsort((first_seen, -pitch_counts[unique_pitches]))[:5]
+            most_common_notes = [
+                (NOTE_NAMES[int(unique_pitches[i])], int(pitch_counts[unique_pitches[i]]))
+                for i in top
+            ]
             
             # Calculate pitch range
+            lowest = int(pitch_array.min())
+            highest = int(pitch_array.max())
             pitch_range = {
-                'lowest': min(pitches),
-                'highest': max(pitches),
-                'lowest_note': pretty_midi.note_number_to_name(min(pitches)),
-                'highest_note': pretty_midi.note_number_to_name(max(pitches)),
-                'range_semitones': max(pitches) - min(pitches)
+                'lowest': lowest,
+                'highest': highest,
+                'lowest_note': NOTE_NAMES[lowest],
+                'highest_note': NOTE_NAMES[highest],
+                'range_semitones': highest - lowest
             }
             
             # Analyze rhythm patterns
             note_durations_stats = {
                 'average': round(np.mean(durations), 3),
-                'shortest': round(min(durations), 3),
-                'longest': round(max(durations), 3),
+                'shortest': round(float(durations.min()), 3),
+                'longest': round(float(durations.max()), 3),
                 'std_dev': round(np.std(durations), 3)
             }
             
             # Extract melody line (highest notes in time windows)
-            melody_line = extract_melody_line(notes)
+            melody_line = extract_melody_line(start_times, end_times, pitch_array)
+            
+            # Limit to first 50 notes
+            all_notes = []
+            for i in order[:50]:
+                all_notes.append({
+                    'pitch': pitches[i],
+                    'note_name': NOTE_NAMES[pitches[i]],
+                    'start': round(starts[i], 3),
+                    'end': round(ends[i], 3),
+                    'duration': round(ends[i] - starts[i], 3),
+                    'velocity': velocities[i]
+                })
             
             return {
                 'method': 'basic_pitch',
-                'total_notes': len(notes),
+                'total_notes': len(pitches),
                 'pitch_range': pitch_range,
                 'most_common_notes': most_common_notes,
                 'note_durations': note_durations_stats,
                 'melody_line': melody_line[:20],  # First 20 melody notes
-                'all_notes': notes[:50] if len(notes) <= 50 else notes[:50]  # Limit to first 50 notes
+                'all_notes': all_notes
             }
         else:
             # Fallback to librosa-based analysis
@@ -886,40 +1463,81 @@ def analyze_basic_pitch(file_path):
         # Fallback to librosa-based analysis
         return analyze_music_theory_librosa(file_path)
 
-def extract_melody_line(notes, window_size=0.5):
-    """Extract melody line by finding highest pitch in time windows"""
-    if not notes:
-        return []
+@numba.njit(cache=True)
+def highest_note_per_window(starts, ends, pitches, window_size):
+    """
+    Index of the highest note sounding in each fixed-size window (-1 if none)
+    Takes parallel arrays sorted by start time; returns (window times, indices)
+    """
+    # Window starts are w * window_size rather than a running float sum, so
+    # long files don't drift or gain/lose a window to rounding
+    n_windows = int(np.ceil(ends.max() / window_size))
     
-    melody = []
-    current_time = 0
-    max_time = max(note['end'] for note in notes)
+    times = np.empty(n_windows)
+    highest = np.full(n_windows, -1, dtype=np.int64)
     
-    while current_time < max_time:
+    # Notes are sorted by start, so the set that has started by the end of
+    # each window only ever grows; and window starts only move forward, so a
+    # note that has ended before one window never sounds in a later one.
+    # `alive` holds started, not-yet-expired notes in start order
+    alive = np.empty(len(starts), dtype=np.int64)
+    n_alive = 0
+    started = 0
+    for w in range(n_windows):
+        current_time = w * window_size
         window_end = current_time + window_size
+        while started < len(starts) and starts[started] <= window_end:
+            alive[n_alive] = started
+            n_alive += 1
+            started += 1
         
-        # Find notes in current window
-        window_notes = [note for note in notes 
-                       if note['start'] <= window_end and note['end'] >= current_time]
+        # Drop expired notes (stable, so index order is kept) while finding
+        # the highest still-sounding note, keeping the earliest of equals
+        kept = 0
+        for a in range(n_alive):
+            i = alive[a]
+            if ends[i] >= current_time:
+                alive[kept] = i
+                kept += 1
+                if highest[w] < 0 or pitches[i] > pitches[highest[w]]:
+                    highest[w] = i
+        n_alive = kept
         
-        if window_notes:
-            # Get highest pitch note in window
-            highest_note = max(window_notes, key=lambda x: x['pitch'])
+        times[w] = current_time
+    
+    return times, highest
+
+# Compile the kernel now rather than on the first request (cache=True also
+# persists it to __pycache__ across restarts)
+EXECUTOR.submit(highest_note_per_window, np.zeros(1), np.ones(1), np.zeros(1, dtype=np.int64), 0.5)
+
+def extract_melody_line(starts, ends, pitches, window_size=0.5):
+    """Extract melody line by finding highest pitch in time windows
+
+    Takes parallel start/end/pitch arrays sorted by start time.
+    """
+    if len(pitches) == 0:
+        return []
+    
+    times, highest = highest_note_per_window(starts, ends, pitches, window_size)
+    
+    melody = []
+    for current_time, note_index in zip(times, highest):
+        if note_index >= 0:
+            highest_pitch = int(pitches[note_index])
             melody.append({
-                'time': round(current_time, 2),
-                'pitch': highest_note['pitch'],
-                'note_name': highest_note['note_name']
+                'time': round(float(current_time), 2),
+                'pitch': highest_pitch,
+                'note_name': NOTE_NAMES[highest_pitch]
             })
-        
-        current_time += window_size
     
     return melody
 
 def analyze_music_theory_librosa(file_path):
     """Fallback music theory analysis using Librosa when Basic Pitch fails"""
     try:
-        # Load audio
-        y, sr = librosa.load(file_path, sr=22050)
+        # Load audio (analysis window only)
+        y, sr = load_audio(file_path, 22050, ANALYSIS_MAX_SECONDS)
         
         # Enhanced chroma analysis for better note detection
         chroma = librosa.feature.chroma_cqt(y=y, sr=sr, hop_length=512)
@@ -931,65 +1549,62 @@ def analyze_music_theory_librosa(file_path):
         # Pitch tracking using piptrack
         pitches, magnitudes = librosa.piptrack(y=y, sr=sr, hop_length=512)
         
-        # Extract dominant pitches over time
-        pitch_sequence = []
-        for t in range(pitches.shape[1]):
-            index = magnitudes[:, t].argmax()
-            pitch = pitches[index, t]
-            if pitch > 0:  # Valid pitch
-                pitch_sequence.append({
-                    'time': librosa.frames_to_time(t, sr=sr, hop_length=512),
-                    'frequency': pitch,
-                    'pitch_class': librosa.hz_to_note(pitch) if pitch > 0 else 'N/A'
-                })
+        # Strongest pitch in every frame at once, keeping only voiced frames
+        strongest = magnitudes.argmax(axis=0)
+        frame_pitches = pitches[strongest, np.arange(pitches.shape[1])]
+        voiced_frames = np.flatnonzero(frame_pitches > 0)
+        voiced_pitches = frame_pitches[voiced_frames]
         
         # Analyze chroma features for note distribution
         chroma_mean = np.mean(chroma, axis=1)
-        note_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-        note_strengths = [(note_names[i], float(chroma_mean[i])) for i in range(12)]
-        note_strengths.sort(key=lambda x: x[1], reverse=True)
+        # Only the 5 strongest pitch classes are reported (ties keep C..B order)
+        strongest = heapq.nlargest(5, range(12), key=lambda i: chroma_mean[i])
+        note_strengths = [(PITCH_CLASSES[i], float(chroma_mean[i])) for i in strongest]
         
         # Estimate pitch range from valid pitches
-        valid_pitches = [p['frequency'] for p in pitch_sequence if p['frequency'] > 0]
-        
-        if valid_pitches:
-            min_freq = min(valid_pitches)
-            max_freq = max(valid_pitches)
+        if voiced_pitches.size:
+            min_freq = voiced_pitches.min()
+            max_freq = voiced_pitches.max()
+            lowest_note, highest_note = librosa.hz_to_note([min_freq, max_freq])
             
             pitch_range = {
                 'lowest_freq': round(min_freq, 2),
                 'highest_freq': round(max_freq, 2),
-                'lowest_note': librosa.hz_to_note(min_freq),
-                'highest_note': librosa.hz_to_note(max_freq),
+                'lowest_note': lowest_note,
+                'highest_note': highest_note,
                 'range_octaves': round(np.log2(max_freq / min_freq), 2)
             }
         else:
             pitch_range = None
         
-        # Create melody line from pitch sequence (simplified)
+        # Create melody line from pitch sequence (simplified) - only the
+        # 20 returned samples get converted to times and note names
         melody_line = []
-        if pitch_sequence:
-            # Sample every 0.5 seconds
-            for i in range(0, len(pitch_sequence), max(1, len(pitch_sequence) // 40)):
-                p = pitch_sequence[i]
-                if p['frequency'] > 0:
-                    melody_line.append({
-                        'time': round(p['time'], 2),
-                        'note_name': p['pitch_class'],
-                        'frequency': round(p['frequency'], 2)
-                    })
+        if voiced_pitches.size:
+            step = max(1, voiced_pitches.size // 40)
+            sampled = np.arange(0, voiced_pitches.size, step)[:20]
+            sample_times = librosa.frames_to_time(voiced_frames[sampled], sr=sr, hop_length=512)
+            sample_pitches = voiced_pitches[sampled]
+            # hz_to_note converts the whole batch in one vectorized call
+            sample_notes = librosa.hz_to_note(sample_pitches)
+            for sample_time, note_name, frequency in zip(sample_times, sample_notes, sample_pitches):
+                melody_line.append({
+                    'time': round(sample_time, 2),
+                    'note_name': note_name,
+                    'frequency': round(frequency, 2)
+                })
         
         return {
             'method': 'librosa_fallback',
-            'total_notes': len([p for p in pitch_sequence if p['frequency'] > 0]),
+            'total_notes': int(voiced_pitches.size),
             'pitch_range': pitch_range,
-            'most_common_notes': note_strengths[:5],
+            'most_common_notes': note_strengths,
             'note_durations': {
                 'estimated_from_onsets': len(onset_times),
                 'average_onset_interval': round(np.mean(np.diff(onset_times)), 3) if len(onset_times) > 1 else 0
             },
             'melody_line': melody_line[:20],
-            'onset_times': onset_times[:20].tolist() if len(onset_times) > 0 else []
+            'onset_times': onset_times[:20]
         }
         
     except Exception as e:
@@ -1031,448 +1646,610 @@ def generate_midi_filename(track_type, custom_names={}, song_name='', naming_sty
     
     return filename
 
-def extract_chord_progression_midi(file_path, include_tracks=['chords', 'bass', 'melody'], custom_names={}, song_name='', naming_style='descriptive'):
-    """Extract chord progression and create separate downloadable MIDI files for each track"""
+def tempo_bpm(tempo):
+    """Plain float BPM from beat_track's tempo (a scalar or, in newer librosa, a 1-element array)"""
+    return float(np.asarray(tempo).reshape(-1)[0])
+
+def load_and_track_beats(file_path):
+    """
+    Decode audio for the chord paths and beat-track it: (y, sr, tempo, beat frames)
+    Chroma only needs the /analyze rate, so this decodes at ANALYSIS_SR and
+    beat frames are in ANALYSIS_HOP_LENGTH hops
+    """
+    y, sr = load_audio(file_path, ANALYSIS_SR)
+    tempo, beats = librosa.beat.beat_track(y=y, sr=sr, hop_length=ANALYSIS_HOP_LENGTH)
+    return y, sr, tempo, beats
+
+def extract_chord_progression_midi(file_path, include_tracks=['chords', 'bass', 'melody'], custom_names={}, song_name='', naming_style='descriptive', audio=None):
+    """
+    Extract chord progression and create separate downloadable MIDI files for each track
+    audio is an optional (y, sr, tempo, beats) from load_and_track_beats when the caller has it
+    """
+    # Decode and beat-track while Basic Pitch transcribes; the librosa
+    # fallback reuses the same result instead of decoding again
+    audio_future = COMPUTE_EXECUTOR.submit(load_and_track_beats, file_path) if audio is None else None
     try:
         # Use Basic Pitch to get precise note data
-        model_output, midi_data, note_events = predict(file_path)
+        midi_data = transcribe_audio(file_path)
         
         # Get tempo from original audio for MIDI timing
-        y, sr = librosa.load(file_path, sr=22050)
-        tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
+        if audio is None:
+            audio = audio_future.result()
+        y, sr, tempo, beats = audio
+        
+        # Note arrays are sorted once and shared by the chord and melody passes
+        notes = midi_note_arrays(midi_data)
         
         # Analyze chord progression using Basic Pitch's recommended approach
-        chord_progression = analyze_chords_from_midi(midi_data, tempo)
+        chord_progression = analyze_chords_from_midi(midi_data, tempo, notes=notes)
+        
+        track_builders = share_track_builders({
+            'chords': lambda: build_chord_track(chord_progression),
+            'bass': lambda: build_bass_track(chord_progression),
+            'melody': lambda: build_melody_track(midi_data, notes)
+        })
+        
+        # The files are written after the response goes out, so a beatless
+        # 0 BPM can't be left to fail (or write a broken file) there
+        safe_tempo = tempo_bpm(tempo)
+        if safe_tempo <= 0:
+            safe_tempo = 120.0
         
         # Create separate MIDI files for each requested track
-        timestamp = int(time.time())
         midi_files = {}
         
         for track_type in include_tracks:
-            midi_filename = generate_midi_filename(track_type, custom_names, song_name, naming_style, timestamp)
-            midi_path = f"/tmp/{midi_filename}"
+            midi_filename = generate_midi_filename(track_type, custom_names, song_name, naming_style)
+            midi_path = reserve_midi_path(midi_filename)
             
             # Create MIDI file with only this track
-            create_single_track_midi(chord_progression, midi_data, midi_path, track_type, tempo)
+            write_midi_later(midi_path, safe_tempo, track_builders, [track_type])
             
             midi_files[track_type] = {
                 'filename': midi_filename,
-                'download_url': f'/download-midi/{midi_filename}'
+                'download_url': f'/download-midi/{os.path.basename(midi_path)}'
             }
         
         # Also create a combined file for backward compatibility
-        combined_filename = generate_midi_filename('combined', custom_names, song_name, naming_style, timestamp)
-        combined_path = f"/tmp/{combined_filename}"
-        create_multi_track_midi(chord_progression, midi_data, combined_path, include_tracks, tempo)
+        combined_filename = generate_midi_filename('combined', custom_names, song_name, naming_style)
+        combined_path = reserve_midi_path(combined_filename)
+        write_midi_later(combined_path, safe_tempo, track_builders, include_tracks)
         
         return {
             'chord_progression': chord_progression,
             'midi_files': midi_files,
-            'combined_midi_url': f'/download-midi/{combined_filename}',
+            'combined_midi_url': f'/download-midi/{os.path.basename(combined_path)}',
             'total_chords': len(chord_progression),
-            'tempo': float(tempo) if isinstance(tempo, (int, float, np.number)) else float(tempo.item()) if hasattr(tempo, 'item') else 120.0,
+            'tempo': safe_tempo,
             'tracks_included': include_tracks,
             'duration': float(midi_data.get_end_time()) if midi_data.get_end_time() > 0 else 0
         }
         
     except Exception as e:
         # Fallback to Librosa-based chord analysis
-        return extract_chords_librosa_fallback(file_path, include_tracks, custom_names, song_name, naming_style)
+        if audio is None:
+            try:
+                audio = audio_future.result()
+            except Exception:
+                pass  # The fallback decodes (and reports) on its own
+        return extract_chords_librosa_fallback(file_path, include_tracks, custom_names, song_name, naming_style, audio)
 
-def analyze_chords_from_midi(midi_data, tempo, window_size=2.0):
-    """Analyze chord progression from MIDI data using Basic Pitch's approach"""
+def midi_note_arrays(midi_data):
+    """
+    Every note across all instruments as parallel start/end/pitch/velocity
+    arrays, sorted by start time (ties keep instrument order)
+    """
+    notes = [note for instrument in midi_data.instruments for note in instrument.notes]
+    starts = np.array([note.start for note in notes], dtype=np.float64)
+    order = np.argsort(starts, kind='stable')
+    ends = np.array([note.end for note in notes], dtype=np.float64)[order]
+    pitches = np.array([note.pitch for note in notes], dtype=np.int64)[order]
+    velocities = np.array([note.velocity for note in notes], dtype=np.int64)[order]
+    return starts[order], ends, pitches, velocities
+
+def analyze_chords_from_midi(midi_data, tempo, window_size=2.0, notes=None):
+    """
+    Analyze chord progression from MIDI data using Basic Pitch's approach
+    notes is midi_note_arrays(midi_data) when the caller already has it
+    """
     chords = []
     
-    if not midi_data.instruments:
+    starts, ends, pitches, _ = notes if notes is not None else midi_note_arrays(midi_data)
+    if len(pitches) == 0:
         return chords
     
-    # Get all notes from all instruments
-    all_notes = []
-    for instrument in midi_data.instruments:
-        for note in instrument.notes:
-            all_notes.append({
-                'pitch': note.pitch,
-                'start': note.start,
-                'end': note.end,
-                'velocity': note.velocity
-            })
+    # Analyze in time windows (Basic Pitch recommends 2-4 second windows).
+    # One (windows, notes) overlap mask replaces the per-window note scan
+    n_windows = int(np.ceil(ends.max() / window_size))
+    window_starts = np.arange(n_windows) * window_size
+    active = (
+        (starts[None, :] <= (window_starts + window_size)[:, None])
+        & (ends[None, :] >= window_starts[:, None])
+    )
     
-    # Sort by start time
-    all_notes.sort(key=lambda x: x['start'])
+    # Pitch classes sounding in each window, then every window's chord
+    # scored against every template in one pass
+    pitch_class_onehot = np.zeros((len(pitches), 12))
+    pitch_class_onehot[np.arange(len(pitches)), pitches % 12] = 1
+    pitch_class_masks = ((active @ pitch_class_onehot) > 0).astype(np.float64)
+    best_rows, best_scores = best_chord_matches(pitch_class_masks)
     
-    if not all_notes:
-        return chords
-    
-    # Analyze in time windows (Basic Pitch recommends 2-4 second windows)
-    max_time = max(note['end'] for note in all_notes)
-    current_time = 0
-    
-    while current_time < max_time:
-        # Get notes active in this window
-        active_notes = []
-        for note in all_notes:
-            if (note['start'] <= current_time + window_size and 
-                note['end'] >= current_time):
-                active_notes.append(note)
-        
-        if active_notes:
-            # Identify chord from active notes
-            chord_info = identify_chord_from_notes(active_notes, current_time, window_size)
-            if chord_info:
-                chords.append(chord_info)
-        
-        current_time += window_size
+    for w in np.flatnonzero(active.any(axis=1)):
+        chord_info = identify_chord_from_notes(
+            pitches[active[w]].tolist(), float(window_starts[w]), window_size,
+            match=(best_rows[w], best_scores[w])
+        )
+        if chord_info:
+            chords.append(chord_info)
     
     return chords
 
-def identify_chord_from_notes(notes, start_time, duration):
-    """Identify chord name and type from a collection of notes"""
-    if not notes:
+# Chord templates with their intervals from root
+CHORD_TEMPLATES = {
+    'Major': [0, 4, 7],
+    'Minor': [0, 3, 7],
+    'Dominant 7th': [0, 4, 7, 10],
+    'Major 7th': [0, 4, 7, 11],
+    'Minor 7th': [0, 3, 7, 10],
+    'Minor Major 7th': [0, 3, 7, 11],
+    'Diminished': [0, 3, 6],
+    'Diminished 7th': [0, 3, 6, 9],
+    'Half Diminished 7th': [0, 3, 6, 10],
+    'Augmented': [0, 4, 8],
+    'Suspended 2nd': [0, 2, 7],
+    'Suspended 4th': [0, 5, 7],
+    'Add 9': [0, 2, 4, 7],
+    'Major 9th': [0, 2, 4, 7, 11],
+    'Minor 9th': [0, 2, 3, 7, 10]
+}
+
+# Every template transposed to every root as one (chord, root) x pitch-class
+# mask - row i * 12 + root is chord type i built on that root, so rows run in
+# the same chord-then-root order as the template dict
+CHORD_TYPE_NAMES = list(CHORD_TEMPLATES)
+CHORD_TEMPLATE_MATRIX = np.stack([
+    np.isin(np.arange(12), (np.array(template) + root) % 12)
+    for template in CHORD_TEMPLATES.values()
+    for root in range(12)
+]).astype(np.float64)
+CHORD_TEMPLATE_ROOTS = np.tile(np.arange(12), len(CHORD_TEMPLATES))
+CHORD_TEMPLATE_SIZES = CHORD_TEMPLATE_MATRIX.sum(axis=1)
+
+def best_chord_matches(pitch_class_masks):
+    """
+    Best (chord, root) template row and its score for each row of a
+    (windows, 12) pitch-class presence mask - a score of 0 means no match
+    """
+    # Score every (chord, root) pair at once: shared notes over the union
+    # of both note sets (Jaccard)
+    matches = pitch_class_masks @ CHORD_TEMPLATE_MATRIX.T
+    total_notes = CHORD_TEMPLATE_SIZES + pitch_class_masks.sum(axis=1, keepdims=True) - matches
+    
+    # Only roots that are actually sounding, and at least 2 notes must match.
+    # argmax keeps the first best row, as the old chord-by-root loop did
+    candidates = (matches >= 2) & (pitch_class_masks[:, CHORD_TEMPLATE_ROOTS] > 0)
+    scores = np.where(candidates, matches / total_notes, 0.0)
+    best = np.argmax(scores, axis=1)
+    return best, scores[np.arange(len(best)), best]
+
+def identify_chord_from_notes(pitches, start_time, duration, match=None):
+    """
+    Identify chord name and type from the MIDI pitches sounding together
+    match is an already-computed (template row, score) from best_chord_matches
+    """
+    if not pitches:
         return None
     
-    # Get unique pitch classes (remove octave information)
-    pitches = [note['pitch'] for note in notes]
-    pitch_classes = sorted(list(set([p % 12 for p in pitches])))
+    # Get unique pitch classes (remove octave information) as a 12-slot
+    # presence mask
+    pitch_class_mask = np.bincount(np.asarray(pitches) % 12, minlength=12) > 0
+    pitch_classes = np.flatnonzero(pitch_class_mask).tolist()
     
     # Find root note (usually the lowest or most prominent)
     root_pitch = min(pitches) % 12
     
-    # Chord templates with their intervals from root
-    chord_templates = {
-        'Major': [0, 4, 7],
-        'Minor': [0, 3, 7],
-        'Dominant 7th': [0, 4, 7, 10],
-        'Major 7th': [0, 4, 7, 11],
-        'Minor 7th': [0, 3, 7, 10],
-        'Minor Major 7th': [0, 3, 7, 11],
-        'Diminished': [0, 3, 6],
-        'Diminished 7th': [0, 3, 6, 9],
-        'Half Diminished 7th': [0, 3, 6, 10],
-        'Augmented': [0, 4, 8],
-        'Suspended 2nd': [0, 2, 7],
-        'Suspended 4th': [0, 5, 7],
-        'Add 9': [0, 2, 4, 7],
-        'Major 9th': [0, 2, 4, 7, 11],
-        'Minor 9th': [0, 2, 3, 7, 10]
-    }
-    
-    # Note names for root identification
-    note_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+    if match is None:
+        rows, scores = best_chord_matches(pitch_class_mask[None, :].astype(np.float64))
+        match = (rows[0], scores[0])
+    best, score = int(match[0]), float(match[1])
     
-    # Find best matching chord
     best_match = None
-    best_score = 0
-    
-    for chord_name, template in chord_templates.items():
-        # Try each possible root
-        for root in pitch_classes:
-            transposed_template = [(interval + root) % 12 for interval in template]
-            
-            # Calculate match score
-            matches = len(set(pitch_classes) & set(transposed_template))
-            total_notes = len(set(pitch_classes) | set(transposed_template))
-            score = matches / total_notes if total_notes > 0 else 0
-            
-            if score > best_score and matches >= 2:  # At least 2 notes must match
-                best_score = score
-                root_name = note_names[root]
-                best_match = {
-                    'time': round(start_time, 2),
-                    'duration': round(duration, 2),
-                    'chord_name': f"{root_name} {chord_name}",
-                    'root': root_name,
-                    'chord_type': chord_name,
-                    'notes': [note_names[p] for p in sorted(pitch_classes)],
-                    'midi_notes': sorted(pitches),
-                    'confidence': round(best_score, 3)
-                }
+    if score > 0:
+        chord_name = CHORD_TYPE_NAMES[best // 12]
+        root_name = PITCH_CLASSES[best % 12]
+        best_match = {
+            'time': round(start_time, 2),
+            'duration': round(duration, 2),
+            'chord_name': f"{root_name} {chord_name}",
+            'root': root_name,
+            'chord_type': chord_name,
+            'notes': [PITCH_CLASSES[p] for p in pitch_classes],
+            'midi_notes': sorted(pitches),
+            'confidence': round(score, 3)
+        }
     
     # If no good match found, create a generic chord
     if not best_match:
-        root_name = note_names[root_pitch]
+        root_name = PITCH_CLASSES[root_pitch]
         best_match = {
             'time': round(start_time, 2),
             'duration': round(duration, 2),
             'chord_name': f"{root_name} Unknown",
             'root': root_name,
             'chord_type': 'Unknown',
-            'notes': [note_names[p] for p in sorted(pitch_classes)],
+            'notes': [PITCH_CLASSES[p] for p in pitch_classes],
             'midi_notes': sorted(pitches),
             'confidence': 0.5
         }
     
     return best_match
 
-def create_multi_track_midi(chord_progression, original_midi, output_path, include_tracks, tempo):
-    """Create multi-track MIDI file for Ableton Live"""
-    # Create new MIDI file
-    midi_file = pretty_midi.PrettyMIDI(initial_tempo=tempo)
+MIDI_TRACK_ORDER = ('chords', 'bass', 'melody')
+
+# Resolution for files written through symusic (pretty_midi uses its own 220)
+MIDI_TICKS_PER_QUARTER = 480
+
+def midi_track(name, program, starts, ends, pitches, velocity):
+    """One output MIDI track as parallel note arrays (times in seconds)"""
+    pitches = np.asarray(pitches, dtype=np.int64)
+    return {
+        'name': name,
+        'program': program,
+        'start': np.asarray(starts, dtype=np.float64),
+        'end': np.asarray(ends, dtype=np.float64),
+        'pitch': pitches,
+        'velocity': np.full(len(pitches), velocity, dtype=np.int64)
+    }
+
+def build_chord_track(chord_progression):
+    """Block chords (piano), one note per chord tone"""
+    if not chord_progression:
+        return midi_track("Chords", 0, [], [], [], 80)
     
-    if 'chords' in include_tracks:
-        # Track 1: Chord progression (block chords)
-        chord_instrument = pretty_midi.Instrument(program=0, name="Chords")  # Piano
-        
-        for chord in chord_progression:
-            start_time = chord['time']
-            end_time = start_time + chord['duration']
-            
-            # Add all chord notes simultaneously
-            for midi_note in chord['midi_notes']:
-                note = pretty_midi.Note(
-                    velocity=80,
-                    pitch=midi_note,
-                    start=start_time,
-                    end=end_time
-                )
-                chord_instrument.notes.append(note)
-        
-        midi_file.instruments.append(chord_instrument)
+    # Every chord tone shares its chord's start/end, so repeat the per-chord
+    # times by chord size instead of walking the notes one by one
+    chord_starts = np.array([chord['time'] for chord in chord_progression], dtype=np.float64)
+    chord_ends = chord_starts + np.array([chord['duration'] for chord in chord_progression], dtype=np.float64)
+    chord_sizes = [len(chord['midi_notes']) for chord in chord_progression]
+    pitches = np.concatenate([np.asarray(chord['midi_notes'], dtype=np.int64) for chord in chord_progression])
     
-    if 'bass' in include_tracks:
-        # Track 2: Bass line (root notes)
-        bass_instrument = pretty_midi.Instrument(program=32, name="Bass")  # Bass
-        
-        for chord in chord_progression:
-            start_time = chord['time']
-            end_time = start_time + chord['duration']
-            
-            # Add root note in bass register
-            root_midi = min(chord['midi_notes'])
-            while root_midi > 48:  # Keep in bass register (below C3)
-                root_midi -= 12
-            
-            note = pretty_midi.Note(
-                velocity=90,
-                pitch=max(24, root_midi),  # Don't go below C1
-                start=start_time,
-                end=end_time
-            )
-            bass_instrument.notes.append(note)
-        
-        midi_file.instruments.append(bass_instrument)
+    return midi_track(
+        "Chords", 0,  # Piano
+        np.repeat(chord_starts, chord_sizes), np.repeat(chord_ends, chord_sizes),
+        pitches, 80
+    )
+
+def build_bass_track(chord_progression):
+    """Bass line from each chord's lowest note, dropped into the bass register"""
+    roots = np.array([min(chord['midi_notes']) for chord in chord_progression], dtype=np.int64)
+    starts = np.array([chord['time'] for chord in chord_progression], dtype=np.float64)
+    ends = starts + np.array([chord['duration'] for chord in chord_progression], dtype=np.float64)
     
-    if 'melody' in include_tracks and original_midi.instruments:
-        # Track 3: Melody line (highest notes from original)
-        melody_instrument = pretty_midi.Instrument(program=73, name="Melody")  # Flute
-        
-        # Extract melody from original MIDI (highest notes)
-        melody_notes = extract_melody_from_midi(original_midi)
-        
-        for note_info in melody_notes:
-            note = pretty_midi.Note(
-                velocity=70,
-                pitch=note_info['pitch'],
-                start=note_info['start'],
-                end=note_info['end']
-            )
-            melody_instrument.notes.append(note)
-        
-        midi_file.instruments.append(melody_instrument)
+    # Drop whole octaves until at or below C3 (48) - closed form of
+    # "while root > 48: root -= 12" - but never below C1 (24)
+    roots = np.where(roots > 48, 48 - (48 - roots) % 12, roots)
+    np.maximum(roots, 24, out=roots)
     
-    # Write MIDI file
-    midi_file.write(output_path)
+    return midi_track("Bass", 32, starts, ends, roots, 90)  # Bass
 
-def create_single_track_midi(chord_progression, original_midi, output_path, track_type, tempo):
-    """Create single-track MIDI file for specific track type"""
-    # Create new MIDI file
-    midi_file = pretty_midi.PrettyMIDI(initial_tempo=tempo)
+def build_melody_track(original_midi, notes=None):
+    """Melody line (flute) from the highest transcribed notes, None without a transcription"""
+    if not original_midi.instruments:
+        return None
     
-    if track_type == 'chords':
-        # Chord progression (block chords)
-        chord_instrument = pretty_midi.Instrument(program=0, name="Chords")  # Piano
-        
-        for chord in chord_progression:
-            start_time = chord['time']
-            end_time = start_time + chord['duration']
-            
-            # Add all chord notes simultaneously
-            for midi_note in chord['midi_notes']:
-                note = pretty_midi.Note(
-                    velocity=80,
-                    pitch=midi_note,
-                    start=start_time,
-                    end=end_time
-                )
-                chord_instrument.notes.append(note)
-        
-        midi_file.instruments.append(chord_instrument)
+    melody_notes = extract_melody_from_midi(original_midi, notes=notes)
+    return midi_track(
+        "Melody", 73,  # Flute
+        [note_info['start'] for note_info in melody_notes],
+        [note_info['end'] for note_info in melody_notes],
+        [note_info['pitch'] for note_info in melody_notes],
+        70
+    )
+
+def build_top_note_track(chord_progression):
+    """Melody from each chord's highest note, for when there is no transcription"""
+    return midi_track(
+        "Melody", 73,
+        [chord['time'] for chord in chord_progression],
+        [chord['time'] + chord['duration'] for chord in chord_progression],
+        [max(chord['midi_notes']) for chord in chord_progression],
+        70
+    )
+
+def dump_midi_symusic(path, tempo, tracks):
+    """Encode tracks with symusic - notes go in as whole arrays, no per-note Python objects"""
+    score = symusic.Score(MIDI_TICKS_PER_QUARTER)
+    score.tempos.append(symusic.Tempo(0, qpm=tempo))
+    ticks_per_second = MIDI_TICKS_PER_QUARTER * tempo / 60
     
-    elif track_type == 'bass':
-        # Bass line (root notes)
-        bass_instrument = pretty_midi.Instrument(program=32, name="Bass")  # Bass
-        
-        for chord in chord_progression:
-            start_time = chord['time']
-            end_time = start_time + chord['duration']
-            
-            # Add root note in bass register
-            root_midi = min(chord['midi_notes'])
-            while root_midi > 48:  # Keep in bass register (below C3)
-                root_midi -= 12
-            
-            note = pretty_midi.Note(
-                velocity=90,
-                pitch=max(24, root_midi),  # Don't go below C1
-                start=start_time,
-                end=end_time
-            )
-            bass_instrument.notes.append(note)
-        
-        midi_file.instruments.append(bass_instrument)
+    for track in tracks:
+        start_ticks = np.round(track['start'] * ticks_per_second).astype(np.int32)
+        end_ticks = np.round(track['end'] * ticks_per_second).astype(np.int32)
+        out = symusic.Track(name=track['name'], program=track['program'])
+        out.notes = symusic.Note.from_numpy(
+            time=start_ticks,
+            duration=end_ticks - start_ticks,
+            pitch=track['pitch'].astype(np.int8),
+            velocity=track['velocity'].astype(np.int8)
+        )
+        score.tracks.append(out)
     
-    elif track_type == 'melody' and original_midi.instruments:
-        # Melody line (highest notes from original)
-        melody_instrument = pretty_midi.Instrument(program=73, name="Melody")  # Flute
-        
-        # Extract melody from original MIDI (highest notes)
-        melody_notes = extract_melody_from_midi(original_midi)
-        
-        for note_info in melody_notes:
-            note = pretty_midi.Note(
-                velocity=70,
-                pitch=note_info['pitch'],
-                start=note_info['start'],
-                end=note_info['end']
+    score.dump_midi(path)
+
+def dump_midi_pretty_midi(path, tempo, tracks):
+    """Encode tracks with pretty_midi when symusic isn't installed"""
+    midi_file = pretty_midi.PrettyMIDI(initial_tempo=tempo)
+    
+    for track in tracks:
+        instrument = pretty_midi.Instrument(program=track['program'], name=track['name'])
+        instrument.notes = [
+            pretty_midi.Note(velocity=velocity, pitch=pitch, start=start, end=end)
+            for start, end, pitch, velocity in zip(
+                track['start'].tolist(), track['end'].tolist(),
+                track['pitch'].tolist(), track['velocity'].tolist()
             )
-            melody_instrument.notes.append(note)
-        
-        midi_file.instruments.append(melody_instrument)
+        ]
+        midi_file.instruments.append(instrument)
     
-    # Write MIDI file
-    midi_file.write(output_path)
+    midi_file.write(path)
 
-def extract_melody_from_midi(midi_data, window_size=0.5):
-    """Extract melody line by finding highest pitch in time windows"""
-    if not midi_data.instruments:
-        return []
+def share_track_builders(track_builders):
+    """
+    Wrap track builders so each track is built once and the result reused by
+    every file that includes it (the per-track files and the combined one)
+    """
+    return {track_type: functools.lru_cache(maxsize=None)(builder) for track_type, builder in track_builders.items()}
+
+# Generated MIDI files live here until downloaded (nginx's X-Accel alias
+# points at the same directory)
+MIDI_OUTPUT_DIR = '/tmp'
+
+def reserve_midi_path(midi_filename):
+    """
+    Claim a unique path for a MIDI file: the readable name plus a random
+    '~xxxxxxxx' tag, so two requests for the same song never overwrite each
+    other's files. Only the '<path>.part' file write_midi fills in is created;
+    the .mid itself first appears, complete, when that is renamed into place
+    """
+    stem = os.path.splitext(midi_filename)[0]
+    while True:
+        fd, partial_path = tempfile.mkstemp(prefix=f"{stem}~", suffix='.mid.part', dir=MIDI_OUTPUT_DIR)
+        os.close(fd)
+        midi_path = partial_path[:-len('.part')]
+        if not os.path.exists(midi_path):
+            return midi_path
+        # The tag is taken by a finished file still waiting to be downloaded
+        os.remove(partial_path)
+
+def midi_download_name(stored_filename):
+    """The readable filename a reserved MIDI file is downloaded as (the tag dropped)"""
+    stem = os.path.splitext(stored_filename)[0]
+    return stem.rsplit('~', 1)[0] + '.mid'
+
+# output path -> Future for MIDI files still being written on IO_EXECUTOR,
+# and the paths this worker has finished writing and not yet served (oldest
+# first, capped - files nobody downloads must not pin entries forever)
+_pending_midi_writes = {}
+_written_midi = OrderedDict()
+_pending_midi_lock = threading.Lock()
+WRITTEN_MIDI_REGISTRY_SIZE = 256
+
+def write_midi(output_path, tempo, track_builders, include_tracks):
+    """
+    Write a MIDI file holding the requested tracks in chords/bass/melody order
+    track_builders maps track type -> zero-arg callable returning a midi_track (or None)
+    """
+    tracks = []
+    for track_type in MIDI_TRACK_ORDER:
+        if track_type in include_tracks and track_type in track_builders:
+            track = track_builders[track_type]()
+            if track is not None:
+                tracks.append(track)
     
-    # Get all notes
-    all_notes = []
-    for instrument in midi_data.instruments:
-        for note in instrument.notes:
-            all_notes.append({
-                'pitch': note.pitch,
-                'start': note.start,
-                'end': note.end,
-                'velocity': note.velocity
-            })
+    tempo = tempo_bpm(tempo)
     
-    if not all_notes:
-        return []
+    # Fill in the .part file reserve_midi_path created and rename it, so
+    # /download-midi (possibly in another worker) never sees a half-written
+    # or empty .mid
+    partial_path = f"{output_path}.part"
+    try:
+        if symusic is not None:
+            dump_midi_symusic(partial_path, tempo, tracks)
+        else:
+            dump_midi_pretty_midi(partial_path, tempo, tracks)
+        os.replace(partial_path, output_path)
+    except Exception:
+        _remove_path(partial_path)
+        raise
+
+def write_midi_later(output_path, tempo, track_builders, include_tracks):
+    """
+    Queue write_midi on IO_EXECUTOR so the chord JSON can go out while the
+    files are built; /download-midi waits on the write if it gets there first
+    """
+    future = IO_EXECUTOR.submit(write_midi, output_path, tempo, track_builders, include_tracks)
+    
+    def forget(done):
+        with _pending_midi_lock:
+            if _pending_midi_writes.get(output_path) is done:
+                del _pending_midi_writes[output_path]
+            if done.exception() is None:
+                _written_midi[output_path] = None
+                while len(_written_midi) > WRITTEN_MIDI_REGISTRY_SIZE:
+                    _written_midi.popitem(last=False)
     
-    # Sort by start time
-    all_notes.sort(key=lambda x: x['start'])
+    with _pending_midi_lock:
+        _pending_midi_writes[output_path] = future
+    future.add_done_callback(forget)
+
+def claim_written_midi(output_path):
+    """True (once) if this worker wrote output_path, so a download can skip the stat"""
+    with _pending_midi_lock:
+        if output_path in _written_midi:
+            del _written_midi[output_path]
+            return True
+    return False
+
+# A write queued by another worker is only visible as its .part file; poll
+# for the rename this long before giving up
+MIDI_WRITE_WAIT = 30  # seconds
+MIDI_WRITE_POLL_INTERVAL = 0.05  # seconds
+
+def wait_for_midi(output_path):
+    """Block until any queued write of output_path has finished (re-raises its error)"""
+    with _pending_midi_lock:
+        future = _pending_midi_writes.get(output_path)
+    if future is not None:
+        future.result()
+        return
+    
+    partial_path = f"{output_path}.part"
+    deadline = time.monotonic() + MIDI_WRITE_WAIT
+    while (not os.path.exists(output_path) and os.path.exists(partial_path)
+           and time.monotonic() < deadline):
+        time.sleep(MIDI_WRITE_POLL_INTERVAL)
+
+def extract_melody_from_midi(midi_data, window_size=0.5, notes=None):
+    """
+    Extract melody line by finding highest pitch in time windows
+    notes is midi_note_arrays(midi_data) when the caller already has it
+    """
+    starts, ends, pitches, velocities = notes if notes is not None else midi_note_arrays(midi_data)
+    if len(pitches) == 0:
+        return []
     
     # Extract melody using time windows
-    melody_notes = []
-    max_time = max(note['end'] for note in all_notes)
-    current_time = 0
+    times, highest = highest_note_per_window(starts, ends, pitches, window_size)
     
-    while current_time < max_time:
-        # Find highest note in this window
-        window_notes = [
-            note for note in all_notes
-            if note['start'] <= current_time + window_size and note['end'] >= current_time
-        ]
-        
-        if window_notes:
-            highest_note = max(window_notes, key=lambda x: x['pitch'])
+    melody_notes = []
+    for current_time, note_index in zip(times.tolist(), highest.tolist()):
+        if note_index >= 0:
             melody_notes.append({
-                'pitch': highest_note['pitch'],
+                'pitch': int(pitches[note_index]),
                 'start': current_time,
                 'end': current_time + window_size,
-                'velocity': highest_note['velocity']
+                'velocity': int(velocities[note_index])
             })
-        
-        current_time += window_size
     
     return melody_notes
 
-def extract_chords_librosa_fallback(file_path, include_tracks, custom_names={}, song_name='', naming_style='descriptive'):
+@numba.njit(cache=True)
+def top_chroma_per_segment(chroma, seg_starts, seg_ends, k, threshold):
+    """
+    The k strongest pitch classes of each [start, end) frame segment's mean
+    chroma, weakest first, with -1 for any at or below threshold
+    """
+    n_segments = len(seg_starts)
+    top = np.full((n_segments, k), -1, dtype=np.int64)
+    
+    for s in range(n_segments):
+        start, end = seg_starts[s], seg_ends[s]
+        if end <= start:
+            continue  # Empty span - no mean, no notes
+        
+        segment_mean = np.zeros(chroma.shape[0])
+        for f in range(start, end):
+            for p in range(chroma.shape[0]):
+                segment_mean[p] += chroma[p, f]
+        segment_mean /= end - start
+        
+        order = np.argsort(segment_mean, kind='mergesort')[-k:]
+        for j in range(k):
+            if segment_mean[order[j]] > threshold:
+                top[s, j] = order[j]
+    
+    return top
+
+# Compile alongside highest_note_per_window
+EXECUTOR.submit(top_chroma_per_segment, np.zeros((12, 2)), np.zeros(1, dtype=np.int64), np.ones(1, dtype=np.int64), 4, 0.3)
+
+def extract_chords_librosa_fallback(file_path, include_tracks, custom_names={}, song_name='', naming_style='descriptive', audio=None):
     """Fallback chord extraction using enhanced Librosa analysis"""
     try:
-        # Load audio
-        y, sr = librosa.load(file_path, sr=22050)
+        # Load audio and get tempo and beats, unless the caller already did
+        y, sr, tempo, beats = audio if audio is not None else load_and_track_beats(file_path)
+        beat_times = librosa.frames_to_time(beats, sr=sr, hop_length=ANALYSIS_HOP_LENGTH)
         
-        # Get tempo and beats
-        tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-        beat_times = librosa.frames_to_time(beats, sr=sr)
+        # Enhanced chroma analysis - the CQT's top octave (~4.2 kHz) sits
+        # under ANALYSIS_SR's Nyquist, and the hop keeps the 23 ms frame rate
+        chroma = librosa.feature.chroma_cqt(y=y, sr=sr, hop_length=ANALYSIS_HOP_LENGTH)
         
-        # Enhanced chroma analysis
-        chroma = librosa.feature.chroma_cqt(y=y, sr=sr, hop_length=512)
+        # Analyze chords at beat positions - chroma frames for every beat
+        # boundary at once, keeping beats whose span lies inside the chroma
+        beat_frames = librosa.time_to_frames(beat_times, sr=sr, hop_length=ANALYSIS_HOP_LENGTH)
+        seg_starts, seg_ends = beat_frames[:-1], beat_frames[1:]
+        valid = np.flatnonzero((seg_starts < chroma.shape[1]) & (seg_ends <= chroma.shape[1]))
+        
+        # Get top 3-4 notes per beat (threshold for significant notes: 0.3)
+        top_notes = top_chroma_per_segment(
+            np.ascontiguousarray(chroma, dtype=np.float64),
+            seg_starts[valid].astype(np.int64), seg_ends[valid].astype(np.int64),
+            4, 0.3
+        )
         
-        # Analyze chords at beat positions
         chord_progression = []
         
-        for i in range(len(beat_times) - 1):
-            start_time = float(beat_times[i])
-            end_time = float(beat_times[i + 1])
-            duration = end_time - start_time
-            
-            # Get chroma for this beat
-            start_frame = librosa.time_to_frames(start_time, sr=sr, hop_length=512)
-            end_frame = librosa.time_to_frames(end_time, sr=sr, hop_length=512)
+        for i, top_indices in zip(valid.tolist(), top_notes.tolist()):
+            # Find dominant notes
+            dominant_indices = [idx for idx in top_indices if idx >= 0]
+            dominant_notes = [PITCH_CLASSES[idx] for idx in dominant_indices]
             
-            if start_frame < chroma.shape[1] and end_frame <= chroma.shape[1]:
-                beat_chroma = np.mean(chroma[:, start_frame:end_frame], axis=1)
-                
-                # Find dominant notes
-                note_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-                dominant_notes = []
+            if len(dominant_notes) >= 2:
+                start_time = float(beat_times[i])
+                duration = float(beat_times[i + 1]) - start_time
                 
-                # Get top 3-4 notes
-                top_indices = np.argsort(beat_chroma)[-4:]
-                for idx in top_indices:
-                    if beat_chroma[idx] > 0.3:  # Threshold for significant notes
-                        dominant_notes.append(note_names[idx])
+                # Simple chord naming based on dominant notes
+                root = dominant_notes[0]
+                chord_name = f"{root} Chord"
                 
-                if len(dominant_notes) >= 2:
-                    # Simple chord naming based on dominant notes
-                    root = dominant_notes[0]
-                    chord_name = f"{root} Chord"
-                    
-                    chord_progression.append({
-                        'time': round(start_time, 2),
-                        'duration': round(duration, 2),
-                        'chord_name': chord_name,
-                        'root': root,
-                        'chord_type': 'Estimated',
-                        'notes': dominant_notes,
-                        'midi_notes': [note_names.index(note) + 60 for note in dominant_notes],  # C4 = 60
-                        'confidence': 0.7
-                    })
+                chord_progression.append({
+                    'time': round(start_time, 2),
+                    'duration': round(duration, 2),
+                    'chord_name': chord_name,
+                    'root': root,
+                    'chord_type': 'Estimated',
+                    'notes': dominant_notes,
+                    'midi_notes': [idx + 60 for idx in dominant_indices],  # C4 = 60
+                    'confidence': 0.7
+                })
         
         # Create separate MIDI files for each requested track
-        timestamp = int(time.time())
         midi_files = {}
         
         # Ensure tempo is valid
-        safe_tempo = float(tempo) if isinstance(tempo, (int, float, np.number)) else float(tempo.item()) if hasattr(tempo, 'item') else 120.0
+        safe_tempo = tempo_bpm(tempo)
         if safe_tempo <= 0:
             safe_tempo = 120.0
         
+        track_builders = share_track_builders({
+            'chords': lambda: build_chord_track(chord_progression),
+            'bass': lambda: build_bass_track(chord_progression),
+            'melody': lambda: build_top_note_track(chord_progression)
+        })
+        
         for track_type in include_tracks:
-            midi_filename = generate_midi_filename(track_type, custom_names, song_name, naming_style, timestamp)
-            midi_path = f"/tmp/{midi_filename}"
+            midi_filename = generate_midi_filename(track_type, custom_names, song_name, naming_style)
+            midi_path = reserve_midi_path(midi_filename)
             
             # Create MIDI file with only this track
-            create_simple_single_track_midi(chord_progression, midi_path, safe_tempo, track_type)
+            write_midi_later(midi_path, safe_tempo, track_builders, [track_type])
             
             midi_files[track_type] = {
                 'filename': midi_filename,
-                'download_url': f'/download-midi/{midi_filename}'
+                'download_url': f'/download-midi/{os.path.basename(midi_path)}'
             }
         
         # Also create a combined file for backward compatibility
-        combined_filename = generate_midi_filename('combined', custom_names, song_name, naming_style, timestamp)
-        combined_path = f"/tmp/{combined_filename}"
-        create_simple_chord_midi(chord_progression, combined_path, safe_tempo, include_tracks)
+        combined_filename = generate_midi_filename('combined', custom_names, song_name, naming_style)
+        combined_path = reserve_midi_path(combined_filename)
+        # The estimated chords are the only track worth combining here
+        write_midi_later(combined_path, safe_tempo, {'chords': track_builders['chords']}, include_tracks)
         
         return {
             'method': 'librosa_fallback',
             'chord_progression': chord_progression,
             'midi_files': midi_files,
-            'combined_midi_url': f'/download-midi/{combined_filename}',
+            'combined_midi_url': f'/download-midi/{os.path.basename(combined_path)}',
             'total_chords': len(chord_progression),
             'tempo': safe_tempo,
             'tracks_included': include_tracks,
@@ -1487,111 +2264,19 @@ def extract_chords_librosa_fallback(file_path, include_tracks, custom_names={},
             'total_chords': 0
         }
 
-def create_simple_chord_midi(chord_progression, output_path, tempo, include_tracks):
-    """Create simple MIDI file from Librosa chord analysis"""
-    midi_file = pretty_midi.PrettyMIDI(initial_tempo=tempo)
-    
-    if 'chords' in include_tracks:
-        chord_instrument = pretty_midi.Instrument(program=0, name="Chords")
-        
-        for chord in chord_progression:
-            start_time = chord['time']
-            end_time = start_time + chord['duration']
-            
-            for midi_note in chord['midi_notes']:
-                note = pretty_midi.Note(
-                    velocity=80,
-                    pitch=midi_note,
-                    start=start_time,
-                    end=end_time
-                )
-                chord_instrument.notes.append(note)
-        
-        midi_file.instruments.append(chord_instrument)
-    
-    midi_file.write(output_path)
-
-def create_simple_single_track_midi(chord_progression, output_path, tempo, track_type):
-    """Create simple single-track MIDI file from Librosa chord analysis"""
-    midi_file = pretty_midi.PrettyMIDI(initial_tempo=tempo)
-    
-    if track_type == 'chords':
-        chord_instrument = pretty_midi.Instrument(program=0, name="Chords")
-        
-        for chord in chord_progression:
-            start_time = chord['time']
-            end_time = start_time + chord['duration']
-            
-            for midi_note in chord['midi_notes']:
-                note = pretty_midi.Note(
-                    velocity=80,
-                    pitch=midi_note,
-                    start=start_time,
-                    end=end_time
-                )
-                chord_instrument.notes.append(note)
-        
-        midi_file.instruments.append(chord_instrument)
-    
-    elif track_type == 'bass':
-        bass_instrument = pretty_midi.Instrument(program=32, name="Bass")
-        
-        for chord in chord_progression:
-            start_time = chord['time']
-            end_time = start_time + chord['duration']
-            
-            # Add root note in bass register
-            root_midi = min(chord['midi_notes'])
-            while root_midi > 48:  # Keep in bass register (below C3)
-                root_midi -= 12
-            
-            note = pretty_midi.Note(
-                velocity=90,
-                pitch=max(24, root_midi),  # Don't go below C1
-                start=start_time,
-                end=end_time
-            )
-            bass_instrument.notes.append(note)
-        
-        midi_file.instruments.append(bass_instrument)
-    
-    elif track_type == 'melody':
-        # For Librosa fallback, create a simple melody from the highest chord notes
-        melody_instrument = pretty_midi.Instrument(program=73, name="Melody")
-        
-        for chord in chord_progression:
-            start_time = chord['time']
-            end_time = start_time + chord['duration']
-            
-            # Use highest note from chord as melody
-            melody_note = max(chord['midi_notes'])
-            
-            note = pretty_midi.Note(
-                velocity=70,
-                pitch=melody_note,
-                start=start_time,
-                end=end_time
-            )
-            melody_instrument.notes.append(note)
-        
-        midi_file.instruments.append(melody_instrument)
-    
-    midi_file.write(output_path)
-
 @app.route('/extract-chords-midi', methods=['POST'])
 def extract_chords_midi():
     """Extract chord progression and return downloadable MIDI file"""
-    tmp_path = None  # Track file for cleanup
     try:
         # Check API key
         api_key = request.headers.get('X-API-Key')
         expected_key = os.environ.get('LIBROSA_API_KEY')
 
         if not expected_key:
-            return jsonify({'error': 'API key not configured on server'}), 500
+            return json_response({'error': 'API key not configured on server'}, 500)
 
         if not api_key or api_key != expected_key:
-            return jsonify({'error': 'Invalid or missing API key'}), 401
+            return json_response({'error': 'Invalid or missing API key'}, 401)
 
         data = request.get_json()
         audio_url = data.get('audio_url')
@@ -1603,32 +2288,38 @@ def extract_chords_midi():
         naming_style = data.get('naming_style', 'descriptive')  # 'descriptive', 'simple', 'timestamp'
 
         if not audio_url:
-            return jsonify({'error': 'No audio_url provided'}), 400
-
-        # Download audio
-        response = requests.get(audio_url, timeout=30)
-        if response.status_code != 200:
-            return jsonify({'error': 'Failed to download audio file'}), 400
-
-        # Save temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
-            tmp_file.write(response.content)
-            tmp_path = tmp_file.name
+            return json_response({'error': 'No audio_url provided'}, 400)
+
+        # Drop unknown/repeated track names, and refuse before downloading
+        # or transcribing anything when none are left
+        if not isinstance(include_tracks, list):
+            include_tracks = []
+        include_tracks = list(dict.fromkeys(track for track in include_tracks if track in MIDI_TRACK_ORDER))
+        if not include_tracks:
+            return json_response({
+                'error': 'No valid tracks requested',
+                'valid_tracks': list(MIDI_TRACK_ORDER)
+            }, 400)
+
+        # Download audio (streamed to disk, cached by URL)
+        audio_path, download_error = fetch_audio(audio_url)
+        if download_error:
+            return json_response({'error': 'Failed to download audio file'}, 400)
 
         # Extract chords and create MIDI with custom naming
-        result = extract_chord_progression_midi(tmp_path, include_tracks, custom_names, song_name, naming_style)
+        result = extract_chord_progression_midi(audio_path, include_tracks, custom_names, song_name, naming_style)
 
-        return jsonify(result)
+        return json_response(result)
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        # Always cleanup temp audio file
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
+        return json_response({'error': str(e)}, 500)
+
+# Behind nginx, set MIDI_ACCEL_PREFIX to an `internal` location aliased to
+# /tmp/ (e.g. /internal-midi/) and downloads are handed off with
+# X-Accel-Redirect so the file never passes through a Python worker
+MIDI_ACCEL_PREFIX = os.environ.get('MIDI_ACCEL_PREFIX')
+# nginx reads the file after we've responded, so give it this long first
+MIDI_ACCEL_CLEANUP_DELAY = 300  # seconds
 
 @app.route('/download-midi/<filename>', methods=['GET'])
 def download_midi(filename):
@@ -1636,28 +2327,39 @@ def download_midi(filename):
     try:
         # Security: Only allow .mid files, no path traversal
         if not filename.endswith('.mid') or '/' in filename or '\\' in filename:
-            return jsonify({'error': 'Invalid filename'}), 400
-
-        file_path = f"/tmp/{filename}"
-        if not os.path.exists(file_path):
-            return jsonify({'error': 'MIDI file not found'}), 404
+            return json_response({'error': 'Invalid filename'}, 400)
+
+        file_path = os.path.join(MIDI_OUTPUT_DIR, filename)
+        wait_for_midi(file_path)
+        # Files this worker wrote are known to exist; others need a stat
+        if not claim_written_midi(file_path) and not os.path.exists(file_path):
+            return json_response({'error': 'MIDI file not found'}, 404)
+
+        if MIDI_ACCEL_PREFIX:
+            cleanup_timer = threading.Timer(MIDI_ACCEL_CLEANUP_DELAY, discard_path, args=(file_path,))
+            cleanup_timer.daemon = True
+            cleanup_timer.start()
+
+            response = Response(status=200, mimetype='audio/midi')
+            response.headers['X-Accel-Redirect'] = f"{MIDI_ACCEL_PREFIX.rstrip('/')}/{filename}"
+            response.headers['Content-Disposition'] = f'attachment; filename="{midi_download_name(filename)}"'
+            return response
 
         # Schedule cleanup after response is sent
         @after_this_request
         def cleanup(response):
-            try:
-                if os.path.exists(file_path):
-                    os.unlink(file_path)
-            except:
-                pass
+            discard_path(file_path)
             return response
 
         return send_file(file_path,
                         as_attachment=True,
-                        download_name=filename,
+                        download_name=midi_download_name(filename),
                         mimetype='audio/midi')
+    except FileNotFoundError:
+        # A claimed file can still have been removed since it was written
+        return json_response({'error': 'MIDI file not found'}, 404)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}, 500)
 
 
 # =============================================================================
@@ -1683,10 +2385,10 @@ def analyze_full():
         expected_key = os.environ.get('LIBROSA_API_KEY')
 
         if not expected_key:
-            return jsonify({'error': 'API key not configured on server'}), 500
+            return json_response({'error': 'API key not configured on server'}, 500)
 
         if not api_key or api_key != expected_key:
-            return jsonify({'error': 'Invalid or missing API key'}), 401
+            return json_response({'error': 'Invalid or missing API key'}, 401)
 
         # Get request data
         data = request.get_json()
@@ -1695,7 +2397,7 @@ def analyze_full():
         is_master = data.get('is_master', False)
 
         if not audio_url:
-            return jsonify({'error': 'No audio_url provided'}), 400
+            return json_response({'error': 'No audio_url provided'}, 400)
 
         # Get Tonn API key (optional - if not set, skip Tonn analysis)
         tonn_api_key = os.environ.get('ROEX_API_KEY')
@@ -1711,67 +2413,42 @@ def analyze_full():
             audio_path, extract_error = extract_audio_from_url(audio_url, tmp_dir)
 
             if extract_error:
-                return jsonify({
+                return json_response({
                     'error': f'Failed to extract audio from {platform_name}',
                     'details': extract_error,
                     'tip': 'Make sure the track is public and the URL is correct.'
-                }), 400
+                }, 400)
         else:
-            # Direct audio URL - download it
-            try:
-                response = requests.get(audio_url, timeout=60)
-                if response.status_code != 200:
-                    return jsonify({'error': f'Failed to download audio: HTTP {response.status_code}'}), 400
-
-                # Determine extension from URL or content type
-                ext = '.wav'
-                if '.mp3' in audio_url.lower():
-                    ext = '.mp3'
-                elif '.flac' in audio_url.lower():
-                    ext = '.flac'
-                elif '.m4a' in audio_url.lower():
-                    ext = '.m4a'
-
-                audio_path = os.path.join(tmp_dir, f'audio{ext}')
-                with open(audio_path, 'wb') as f:
-                    f.write(response.content)
-
-            except requests.Timeout:
-                return jsonify({'error': 'Audio download timed out'}), 400
-            except Exception as e:
-                return jsonify({'error': f'Failed to download audio: {str(e)}'}), 400
+            # Direct audio URL - stream it into the request's temp dir
+            audio_path, download_error = download_audio_to_file(
+                audio_url, suffix=audio_suffix(audio_url), timeout=60, dir=tmp_dir
+            )
+            if download_error:
+                return json_response({'error': f'Failed to download audio: {download_error}'}, 400)
+
+        # Step 2: Start the Tonn round trip (if API key is set) - it is
+        # almost all waiting on the network, so it runs alongside librosa
+        if tonn_api_key:
+            tonn_future = TONN_EXECUTOR.submit(run_tonn_analysis, audio_path, genre, is_master, tonn_api_key)
+        else:
+            tonn_future = None
 
-        # Step 2: Run Librosa analysis
+        # Step 3: Run Librosa analysis - it is the same result /analyze
+        # produces, so identical audio is served from that cache
         librosa_result = None
         try:
-            librosa_result = analyze_audio_comprehensive(audio_path)
-            librosa_result = convert_numpy_types(librosa_result)
+            audio_hash = hash_audio_file(audio_path)
+            cached = get_cached_analysis(audio_hash)
+            if cached is not None:
+                librosa_result = orjson.loads(cached)
+            else:
+                librosa_result = analyze_audio_comprehensive(audio_path, audio_hash)
+                store_cached_analysis(audio_hash, encode_json(librosa_result))
         except Exception as e:
             librosa_result = {'error': f'Librosa analysis failed: {str(e)}'}
 
-        # Step 3: Run Tonn analysis (if API key is set)
-        tonn_result = None
-        if tonn_api_key:
-            try:
-                # Upload to Tonn
-                readable_url, upload_error = upload_to_tonn(audio_path, tonn_api_key)
-
-                if upload_error:
-                    tonn_result = {'error': f'Tonn upload failed: {upload_error}'}
-                else:
-                    # Run analysis
-                    musical_style = map_genre_to_style(genre)
-                    tonn_data, analysis_error = analyze_with_tonn(
-                        readable_url, musical_style, is_master, tonn_api_key
-                    )
-
-                    if analysis_error:
-                        tonn_result = {'error': f'Tonn analysis failed: {analysis_error}'}
-                    else:
-                        tonn_result = normalize_tonn_response(tonn_data)
-
-            except Exception as e:
-                tonn_result = {'error': f'Tonn analysis error: {str(e)}'}
+        if tonn_future is not None:
+            tonn_result = tonn_future.result()
         else:
             tonn_result = {'skipped': 'ROEX_API_KEY not configured'}
 
@@ -1810,20 +2487,17 @@ def analyze_full():
         result['genre_targets'] = GENRE_TARGETS.get(genre, GENRE_TARGETS['other'])
         result['ai_feedback'] = generate_ai_feedback(result, genre)
 
-        return jsonify(result)
+        return json_response(result)
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}, 500)
 
     finally:
         # Cleanup temp files
-        if tmp_dir and os.path.exists(tmp_dir):
-            try:
-                shutil.rmtree(tmp_dir)
-            except:
-                pass
+        discard_path(tmp_dir)
 
 
 if __name__ == '__main__':
+    # Development server only - production runs under gunicorn (see Procfile)
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
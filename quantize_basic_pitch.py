@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Build reduced-precision copies of the Basic Pitch ICASSP 2022 model.
+
+INT8 (CPU): static QDQ quantization of the ONNX model bundled with
+basic-pitch, calibrated on real audio windows.
+FP16 (GPU): float16 weights/activations with float32 inputs and outputs,
+for onnxruntime's CUDA provider (needs onnxconverter-common).
+
+Point the API at the result with BASIC_PITCH_MODEL_PATH (needs onnxruntime,
+or onnxruntime-gpu for FP16).
+
+Usage:
+    python quantize_basic_pitch.py track1.mp3 track2.wav ... [-o nmp_int8.onnx]
+    python quantize_basic_pitch.py --fp16 [-o nmp_fp16.onnx]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import onnx
+from basic_pitch import build_icassp_2022_model_path, FilenameSuffix
+from basic_pitch.constants import AUDIO_N_SAMPLES, FFT_HOP
+from basic_pitch.inference import get_audio_input
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_static,
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+# Same windowing predict() uses
+OVERLAP_LEN = 30 * FFT_HOP
+HOP_SIZE = AUDIO_N_SAMPLES - OVERLAP_LEN
+INPUT_NAME = "serving_default_input_2:0"
+
+
+class BasicPitchCalibrationReader(CalibrationDataReader):
+    """Feeds model-sized audio windows from calibration files"""
+
+    def __init__(self, audio_paths, max_windows=200):
+        self.windows = []
+        for path in audio_paths:
+            for window, _, _ in get_audio_input(path, OVERLAP_LEN, HOP_SIZE):
+                self.windows.append(window.astype(np.float32))
+        # Spread the budget across the whole calibration set
+        if len(self.windows) > max_windows:
+            keep = np.linspace(0, len(self.windows) - 1, max_windows).astype(int)
+            self.windows = [self.windows[i] for i in keep]
+        self._iter = iter(self.windows)
+
+    def get_next(self):
+        window = next(self._iter, None)
+        return None if window is None else {INPUT_NAME: window}
+
+    def rewind(self):
+        self._iter = iter(self.windows)
+
+
+def convert_to_fp16(source_model, output_path):
+    """Float16 copy of the model, keeping float32 I/O so callers don't change"""
+    from onnxconverter_common import float16
+
+    model = onnx.load(source_model)
+    model_fp16 = float16.convert_float_to_float16(model, keep_io_types=True)
+    onnx.save(model_fp16, output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('audio', nargs='*', help='Representative tracks used for INT8 calibration')
+    parser.add_argument('-o', '--output', help='Where to write the model (default nmp_int8.onnx / nmp_fp16.onnx)')
+    parser.add_argument('--max-windows', type=int, default=200, help='Calibration windows to use')
+    parser.add_argument('--fp16', action='store_true', help='Build a float16 model for GPU instead of INT8')
+    args = parser.parse_args()
+
+    source_model = str(build_icassp_2022_model_path(FilenameSuffix.onnx))
+
+    if args.fp16:
+        output = args.output or 'nmp_fp16.onnx'
+        convert_to_fp16(source_model, output)
+        print(f"Wrote {output}")
+        return
+
+    if not args.audio:
+        parser.error('INT8 quantization needs at least one calibration track')
+    args.output = args.output or 'nmp_int8.onnx'
+
+    reader = BasicPitchCalibrationReader(args.audio, args.max_windows)
+    if not reader.windows:
+        sys.exit('No calibration audio could be read')
+    print(f"Calibrating on {len(reader.windows)} windows from {len(args.audio)} file(s)")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Shape inference + graph cleanup first, as onnxruntime recommends
+        preprocessed = os.path.join(tmp_dir, 'nmp_preprocessed.onnx')
+        quant_pre_process(source_model, preprocessed)
+
+        quantize_static(
+            preprocessed,
+            args.output,
+            reader,
+            quant_format=QuantFormat.QDQ,
+            weight_type=QuantType.QInt8,
+            activation_type=QuantType.QInt8,
+            per_channel=True,
+        )
+
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
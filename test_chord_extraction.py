@@ -8,8 +8,24 @@ import soundfile as sf
 import tempfile
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
-from app import extract_chord_progression_midi
+import atexit
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from app import extract_chord_progression_midi, transcribe_audio, load_and_track_beats
+
+# One pooled session for the whole run, so the POST and the MIDI download
+# that follows it reuse the same keep-alive connection
+HTTP_SESSION = requests.Session()
+_http_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.5)
+)
+HTTP_SESSION.mount('https://', _http_adapter)
+HTTP_SESSION.mount('http://', _http_adapter)
 
 def create_chord_progression_audio():
     """Create test audio with a simple chord progression: C - F - G - C"""
@@ -26,81 +42,70 @@ def create_chord_progression_audio():
     
     progression = ['C_major', 'F_major', 'G_major', 'C_major_end']
     
-    # Generate audio for each chord
-    full_audio = []
+    # Every chord shares the same time axis and decay envelope
+    t = np.linspace(0, chord_duration, int(sample_rate * chord_duration), dtype=np.float32)
+    envelope = np.exp(-t * 0.5)  # Decay envelope
     
-    for chord_name in progression:
-        frequencies = chords[chord_name]
-        t = np.linspace(0, chord_duration, int(sample_rate * chord_duration))
-        
-        # Create chord by summing sine waves
-        chord_audio = np.zeros_like(t)
-        for freq in frequencies:
-            chord_audio += 0.2 * np.sin(2 * np.pi * freq * t)
-        
-        # Add some envelope to make it more realistic
-        envelope = np.exp(-t * 0.5)  # Decay envelope
-        chord_audio *= envelope
-        
-        full_audio.extend(chord_audio)
+    # (chords, notes, 1) frequencies against (samples,) time: every sine
+    # wave in one call, summed per chord, then laid end to end
+    frequencies = np.array([chords[chord_name] for chord_name in progression], dtype=np.float32)[:, :, None]
+    chord_audio = (0.2 * np.sin(2 * np.pi * frequencies * t)).sum(axis=1) * envelope
     
-    return np.array(full_audio), sample_rate
+    return chord_audio.reshape(-1), sample_rate
+
+@functools.lru_cache(maxsize=None)
+def shared_test_wav():
+    """Synthesize the test progression and write it to a WAV once; every test reuses the path"""
+    audio, sr = create_chord_progression_audio()
+    # tmpfs when there is one, so the write and every read-back stay in RAM
+    tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.wav', dir=tmp_dir) as tmp_file:
+        # 16-bit PCM, spelled out rather than left to soundfile's WAV default
+        sf.write(tmp_file.name, audio, sr, subtype='PCM_16')
+    atexit.register(os.unlink, tmp_file.name)
+    return tmp_file.name
 
 def test_chord_extraction_direct():
     """Test chord extraction directly with synthetic audio"""
     print("Creating test chord progression audio (C-F-G-C)...")
-    audio, sr = create_chord_progression_audio()
+    tmp_path = shared_test_wav()
     
-    # Save to temporary file
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
-        sf.write(tmp_file.name, audio, sr)
-        tmp_path = tmp_file.name
+    print("Running chord extraction...")
     
-    try:
-        print("Running chord extraction...")
-        
-        # Test with all tracks
-        result = extract_chord_progression_midi(tmp_path, ['chords', 'bass', 'melody'])
-        
-        print(f"\n=== Chord Extraction Results ({result.get('method', 'unknown')}) ===")
-        print(f"Total chords detected: {result.get('total_chords', 0)}")
-        print(f"Tempo: {result.get('tempo', 'N/A')} BPM")
-        print(f"Duration: {result.get('duration', 'N/A')} seconds")
-        print(f"Tracks included: {result.get('tracks_included', [])}")
-        
-        if result.get('midi_download_url'):
-            print(f"MIDI file: {result['midi_download_url']}")
-        
-        if result.get('chord_progression'):
-            print("\nDetected Chord Progression:")
-            for i, chord in enumerate(result['chord_progression'][:8]):  # Show first 8 chords
-                time_val = chord.get('time', 'N/A')
-                chord_name = chord.get('chord_name', 'Unknown')
-                confidence = chord.get('confidence', 'N/A')
-                notes = chord.get('notes', [])
-                print(f"  {i+1}. Time {time_val}s: {chord_name} (confidence: {confidence}) - Notes: {notes}")
-        
-        if result.get('error'):
-            print(f"Error: {result['error']}")
-        
-        print("\n=== Direct test completed! ===")
-        
-        return result.get('midi_download_url') is not None
-        
-    finally:
-        # Clean up
-        os.unlink(tmp_path)
+    # Test with all tracks
+    result = extract_chord_progression_midi(tmp_path, ['chords', 'bass', 'melody'])
+    
+    print(f"\n=== Chord Extraction Results ({result.get('method', 'unknown')}) ===")
+    print(f"Total chords detected: {result.get('total_chords', 0)}")
+    print(f"Tempo: {result.get('tempo', 'N/A')} BPM")
+    print(f"Duration: {result.get('duration', 'N/A')} seconds")
+    print(f"Tracks included: {result.get('tracks_included', [])}")
+    
+    if result.get('midi_download_url'):
+        print(f"MIDI file: {result['midi_download_url']}")
+    
+    if result.get('chord_progression'):
+        print("\nDetected Chord Progression:")
+        for i, chord in enumerate(result['chord_progression'][:8]):  # Show first 8 chords
+            time_val = chord.get('time', 'N/A')
+            chord_name = chord.get('chord_name', 'Unknown')
+            confidence = chord.get('confidence', 'N/A')
+            notes = chord.get('notes', [])
+            print(f"  {i+1}. Time {time_val}s: {chord_name} (confidence: {confidence}) - Notes: {notes}")
+    
+    if result.get('error'):
+        print(f"Error: {result['error']}")
+    
+    print("\n=== Direct test completed! ===")
+    
+    return result.get('midi_download_url') is not None
 
 def test_api_endpoint():
     """Test the API endpoint with a local server"""
     print("\n=== Testing API Endpoint ===")
     
-    # Create test audio
-    audio, sr = create_chord_progression_audio()
-    
-    # Save to a temporary file that can be served
-    test_file = "/tmp/test_chord_progression.wav"
-    sf.write(test_file, audio, sr)
+    # The shared test WAV, served to the API as a local file
+    test_file = shared_test_wav()
     
     try:
         # Test the API endpoint
@@ -118,7 +123,7 @@ def test_api_endpoint():
         }
         
         print("Making API request...")
-        response = requests.post(api_url, json=payload, headers=headers, timeout=60)
+        response = HTTP_SESSION.post(api_url, json=payload, headers=headers, timeout=60)
         
         if response.status_code == 200:
             result = response.json()
@@ -129,13 +134,14 @@ def test_api_endpoint():
             # Test MIDI download
             if result.get('midi_download_url'):
                 midi_url = f"http://localhost:5000{result['midi_download_url']}"
-                midi_response = requests.get(midi_url, headers={"X-API-Key": "test123"})
-                
-                if midi_response.status_code == 200:
-                    print("✅ MIDI file download successful!")
-                    print(f"MIDI file size: {len(midi_response.content)} bytes")
-                else:
-                    print(f"❌ MIDI download failed: {midi_response.status_code}")
+                # Count the bytes as they stream in rather than holding the body
+                with HTTP_SESSION.get(midi_url, headers={"X-API-Key": "test123"}, stream=True) as midi_response:
+                    if midi_response.status_code == 200:
+                        midi_size = sum(len(chunk) for chunk in midi_response.iter_content(64 * 1024))
+                        print("✅ MIDI file download successful!")
+                        print(f"MIDI file size: {midi_size} bytes")
+                    else:
+                        print(f"❌ MIDI download failed: {midi_response.status_code}")
             
             return True
         else:
@@ -149,36 +155,38 @@ def test_api_endpoint():
     except Exception as e:
         print(f"❌ API test failed: {e}")
         return False
-    finally:
-        # Clean up
-        if os.path.exists(test_file):
-            os.unlink(test_file)
 
 def test_track_selection():
     """Test different track combinations"""
     print("\n=== Testing Track Selection ===")
     
-    audio, sr = create_chord_progression_audio()
-    
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
-        sf.write(tmp_file.name, audio, sr)
-        tmp_path = tmp_file.name
-    
-    try:
-        # Test different track combinations
-        track_combinations = [
-            ['chords'],
-            ['bass'],
-            ['melody'],
-            ['chords', 'bass'],
-            ['chords', 'melody'],
-            ['bass', 'melody'],
-            ['chords', 'bass', 'melody']
-        ]
-        
-        for tracks in track_combinations:
+    tmp_path = shared_test_wav()
+    
+    # Test different track combinations
+    track_combinations = [
+        ['chords'],
+        ['bass'],
+        ['melody'],
+        ['chords', 'bass'],
+        ['chords', 'melody'],
+        ['bass', 'melody'],
+        ['chords', 'bass', 'melody']
+    ]
+    
+    # The combinations are independent, so run them side by side; threads
+    # rather than processes so they share app's transcription and decode
+    # caches (and one loaded Basic Pitch model). Transcribe, decode and
+    # beat-track once up front; only the MIDI assembly differs per run
+    transcribe_audio(tmp_path)
+    audio = load_and_track_beats(tmp_path)
+    with ThreadPoolExecutor(max_workers=min(len(track_combinations), os.cpu_count() or 1)) as pool:
+        results = pool.map(
+            lambda tracks: extract_chord_progression_midi(tmp_path, tracks, audio=audio),
+            track_combinations
+        )
+        
+        for tracks, result in zip(track_combinations, results):
             print(f"\nTesting tracks: {tracks}")
-            result = extract_chord_progression_midi(tmp_path, tracks)
             
             if result.get('tracks_included'):
                 print(f"✅ Successfully created MIDI with tracks: {result['tracks_included']}")
@@ -186,9 +194,6 @@ def test_track_selection():
                 print(f"❌ Failed to create MIDI for tracks: {tracks}")
                 if result.get('error'):
                     print(f"   Error: {result['error']}")
-    
-    finally:
-        os.unlink(tmp_path)
 
 if __name__ == "__main__":
     print("🎵 Testing Chord Extraction and MIDI Export Functionality 🎵\n")
@@ -4,8 +4,36 @@ Test chord extraction with real songs using public audio URLs
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+# One pooled session for the whole run, so the POST and the MIDI download
+# that follows it reuse the same keep-alive connection
+HTTP_SESSION = requests.Session()
+_http_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.5)
+)
+HTTP_SESSION.mount('https://', _http_adapter)
+HTTP_SESSION.mount('http://', _http_adapter)
+
+def wait_for_server(base_url, timeout=10.0, interval=0.05):
+    """Poll the health check until the API answers, rather than sleeping a fixed time"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            # Plain requests, not HTTP_SESSION - its retry backoff would
+            # stretch every failed probe to seconds
+            if requests.head(base_url, timeout=0.5).ok:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(interval)
+    return False
 
 def test_with_public_audio():
     """Test with publicly available audio files"""
@@ -32,53 +60,64 @@ def test_with_public_audio():
     
     print("🎵 Testing Chord Extraction with Real Audio Files 🎵\n")
     
-    for song in test_songs:
-        print(f"Testing: {song['name']}")
-        print(f"URL: {song['url']}")
-        print(f"Tracks: {song['tracks']}")
-        
+    def post_song(song):
         payload = {
             "audio_url": song['url'],
             "include_tracks": song['tracks']
         }
+        return HTTP_SESSION.post(api_url, json=payload, headers=headers, timeout=120)
+    
+    if not wait_for_server("http://localhost:5000/"):
+        print("⚠️  API not answering on localhost:5000 yet - requests may fail")
+    
+    # The client only waits on the server here, so send every song at once
+    # and report them in order as they come back
+    print("Making API requests...")
+    with ThreadPoolExecutor(max_workers=len(test_songs)) as pool:
+        futures = [pool.submit(post_song, song) for song in test_songs]
         
-        try:
-            print("Making API request...")
-            response = requests.post(api_url, json=payload, headers=headers, timeout=120)
+        for song, future in zip(test_songs, futures):
+            print(f"Testing: {song['name']}")
+            print(f"URL: {song['url']}")
+            print(f"Tracks: {song['tracks']}")
             
-            if response.status_code == 200:
-                result = response.json()
-                print("✅ Success!")
-                print(f"Method: {result.get('method', 'unknown')}")
-                print(f"Chords detected: {result.get('total_chords', 0)}")
-                print(f"Tempo: {result.get('tempo', 'N/A')} BPM")
-                print(f"Duration: {result.get('duration', 'N/A')} seconds")
-                
-                if result.get('chord_progression'):
-                    print("Chord progression:")
-                    for i, chord in enumerate(result['chord_progression'][:5]):
-                        print(f"  {i+1}. {chord['time']}s: {chord['chord_name']} - {chord['notes']}")
+            try:
+                response = future.result()
                 
-                if result.get('midi_download_url'):
-                    print(f"MIDI download: {result['midi_download_url']}")
+                if response.status_code == 200:
+                    result = response.json()
+                    print("✅ Success!")
+                    print(f"Method: {result.get('method', 'unknown')}")
+                    print(f"Chords detected: {result.get('total_chords', 0)}")
+                    print(f"Tempo: {result.get('tempo', 'N/A')} BPM")
+                    print(f"Duration: {result.get('duration', 'N/A')} seconds")
                     
-                    # Test MIDI download
-                    midi_url = f"http://localhost:5000{result['midi_download_url']}"
-                    midi_response = requests.get(midi_url)
-                    if midi_response.status_code == 200:
-                        print(f"✅ MIDI file downloaded ({len(midi_response.content)} bytes)")
-                    else:
-                        print("❌ MIDI download failed")
-                
-            else:
-                print(f"❌ API request failed: {response.status_code}")
-                print(f"Error: {response.text}")
+                    if result.get('chord_progression'):
+                        print("Chord progression:")
+                        for i, chord in enumerate(result['chord_progression'][:5]):
+                            print(f"  {i+1}. {chord['time']}s: {chord['chord_name']} - {chord['notes']}")
+                    
+                    if result.get('midi_download_url'):
+                        print(f"MIDI download: {result['midi_download_url']}")
+                        
+                        # Test MIDI download
+                        midi_url = f"http://localhost:5000{result['midi_download_url']}"
+                        # Count the bytes as they stream in rather than holding the body
+                        with HTTP_SESSION.get(midi_url, stream=True) as midi_response:
+                            if midi_response.status_code == 200:
+                                midi_size = sum(len(chunk) for chunk in midi_response.iter_content(64 * 1024))
+                                print(f"✅ MIDI file downloaded ({midi_size} bytes)")
+                            else:
+                                print("❌ MIDI download failed")
+                    
+                else:
+                    print(f"❌ API request failed: {response.status_code}")
+                    print(f"Error: {response.text}")
+                    
+            except Exception as e:
+                print(f"❌ Test failed: {e}")
                 
-        except Exception as e:
-            print(f"❌ Test failed: {e}")
-        
-        print("-" * 50)
-        time.sleep(2)  # Brief pause between tests
+            print("-" * 50)
 
 def test_with_local_file():
     """Test with a local audio file"""
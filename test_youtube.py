@@ -7,10 +7,25 @@ WARNING: Only use this with copyright-free or your own content!
 import os
 import subprocess
 import tempfile
-from app import extract_chord_progression_midi
+import uuid
+try:
+    from yt_dlp import YoutubeDL  # In-process download - skips spawning the CLI
+except ImportError:
+    YoutubeDL = None
+
+# Keep YouTube's own audio stream (m4a/webm) like app.extract_audio_from_url
+# does - decoding it is cheaper than an ffmpeg re-encode to a WAV that is
+# ~10x the size and then has to be read back
+YOUTUBE_AUDIO_FORMAT = 'bestaudio[ext=m4a]/bestaudio[ext=mp3]/bestaudio/best'
 
 def download_youtube_audio(youtube_url, output_path="/tmp/youtube_audio.wav"):
-    """Download audio from YouTube using yt-dlp"""
+    """
+    Download audio from YouTube using yt-dlp
+    output_path's extension is replaced by the stream's own; returns the real path
+    """
+    
+    if YoutubeDL is not None:
+        return download_youtube_audio_in_process(youtube_url, output_path)
     
     try:
         # Check if yt-dlp is installed
@@ -22,13 +37,13 @@ def download_youtube_audio(youtube_url, output_path="/tmp/youtube_audio.wav"):
     try:
         print(f"📥 Downloading audio from: {youtube_url}")
         
-        # Download audio only, convert to wav
+        # Download the audio stream only, and print where it landed
         cmd = [
             "yt-dlp",
-            "-x",  # Extract audio only
-            "--audio-format", "wav",
-            "--audio-quality", "0",  # Best quality
-            "-o", output_path.replace('.wav', '.%(ext)s'),
+            "-f", YOUTUBE_AUDIO_FORMAT,
+            "-o", os.path.splitext(output_path)[0] + '.%(ext)s',
+            "--print", "after_move:filepath",
+            "--no-simulate",
             youtube_url
         ]
         
@@ -36,7 +51,7 @@ def download_youtube_audio(youtube_url, output_path="/tmp/youtube_audio.wav"):
         
         if result.returncode == 0:
             print("✅ Download completed!")
-            return output_path
+            return result.stdout.strip().splitlines()[-1]
         else:
             print(f"❌ Download failed: {result.stderr}")
             return None
@@ -48,14 +63,38 @@ def download_youtube_audio(youtube_url, output_path="/tmp/youtube_audio.wav"):
         print(f"❌ Download error: {e}")
         return None
 
+def download_youtube_audio_in_process(youtube_url, output_path):
+    """Same download through the yt_dlp library - no interpreter to start, no --version probe"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'format': YOUTUBE_AUDIO_FORMAT,
+        'outtmpl': os.path.splitext(output_path)[0] + '.%(ext)s',
+        'socket_timeout': 30,
+    }
+    
+    try:
+        print(f"📥 Downloading audio from: {youtube_url}")
+        with YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(youtube_url, download=True)
+            downloaded_path = ydl.prepare_filename(info)
+        
+        print("✅ Download completed!")
+        return downloaded_path
+            
+    except Exception as e:
+        print(f"❌ Download error: {e}")
+        return None
+
 def test_youtube_song(youtube_url, tracks=['chords', 'bass']):
     """Test chord extraction with a YouTube video"""
     
     print(f"🎵 Testing YouTube URL: {youtube_url}")
     
-    # Download audio
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
-        audio_path = download_youtube_audio(youtube_url, tmp_file.name)
+    # Download audio to a fresh name - yt-dlp swaps in the stream's own
+    # extension, so no placeholder file is created up front
+    output_path = os.path.join(tempfile.gettempdir(), f"yt_{uuid.uuid4().hex}.wav")
+    audio_path = download_youtube_audio(youtube_url, output_path)
     
     if not audio_path or not os.path.exists(audio_path):
         print("❌ Failed to download audio")
@@ -65,7 +104,9 @@ def test_youtube_song(youtube_url, tracks=['chords', 'bass']):
         print(f"🎵 Analyzing downloaded audio...")
         print(f"File size: {os.path.getsize(audio_path)} bytes")
         
-        # Analyze the audio
+        # Analyze the audio - app (librosa, Basic Pitch, TensorFlow) is only
+        # imported once there is something to analyze
+        from app import extract_chord_progression_midi
         result = extract_chord_progression_midi(audio_path, tracks)
         
         print(f"\n=== Analysis Results ===")
@@ -7,22 +7,32 @@ import os
 import shutil
 import requests
 import json
-from app import extract_chord_progression_midi
+from concurrent.futures import ThreadPoolExecutor
 
-def test_uploaded_file(file_path, tracks=['chords', 'bass', 'melody']):
-    """Test chord extraction with an uploaded file"""
+def test_uploaded_file(file_path, tracks=['chords', 'bass', 'melody'], result_future=None):
+    """
+    Test chord extraction with an uploaded file
+    result_future is an already-submitted extraction to report on instead of running one
+    """
     
-    if not os.path.exists(file_path):
+    # One stat answers both "does it exist" and "how big is it"
+    try:
+        file_size = os.stat(file_path).st_size
+    except FileNotFoundError:
         print(f"❌ File not found: {file_path}")
         return
     
     print(f"🎵 Analyzing: {os.path.basename(file_path)}")
-    print(f"File size: {os.path.getsize(file_path)} bytes")
+    print(f"File size: {file_size} bytes")
     print(f"Tracks to extract: {tracks}")
     
     try:
         # Direct function call for faster testing
-        result = extract_chord_progression_midi(file_path, tracks)
+        if result_future is not None:
+            result = result_future.result()
+        else:
+            from app import extract_chord_progression_midi
+            result = extract_chord_progression_midi(file_path, tracks)
         
         print(f"\n=== Analysis Results ===")
         print(f"Method: {result.get('method', 'unknown')}")
@@ -67,28 +77,47 @@ def batch_test_directory(directory_path, file_extensions=['.wav', '.mp3', '.m4a'
     
     print(f"🎵 Batch testing directory: {directory_path}")
     
-    audio_files = []
-    for file in os.listdir(directory_path):
-        if any(file.lower().endswith(ext) for ext in file_extensions):
-            audio_files.append(os.path.join(directory_path, file))
+    # One scandir pass - entries carry their type and inode, so filtering
+    # and ordering need no per-file stat calls
+    extensions = tuple(ext.lower() for ext in file_extensions)
+    with os.scandir(directory_path) as entries:
+        audio_entries = [
+            entry for entry in entries
+            if entry.name.lower().endswith(extensions) and entry.is_file()
+        ]
     
-    if not audio_files:
+    if not audio_entries:
         print(f"❌ No audio files found in {directory_path}")
         return
     
-    print(f"Found {len(audio_files)} audio files")
+    print(f"Found {len(audio_entries)} audio files")
+    
+    # Read files in inode order, which roughly follows their layout on disk
+    audio_entries.sort(key=lambda entry: entry.inode())
+    audio_files = [entry.path for entry in audio_entries]
     
+    # app (librosa, Basic Pitch, TensorFlow) takes seconds to import, so
+    # it is only loaded once there are files to analyze
+    from app import extract_chord_progression_midi
+    
+    # Files are independent, so extract them side by side and report in
+    # order as each finishes. Threads share app's one loaded Basic Pitch
+    # model, and the heavy lifting releases the GIL
+    tracks = ['chords', 'bass']
     results = []
-    for file_path in audio_files:
-        print(f"\n{'='*60}")
-        result = test_uploaded_file(file_path, ['chords', 'bass'])
-        if result:
-            results.append({
-                'file': os.path.basename(file_path),
-                'chords': result.get('total_chords', 0),
-                'tempo': result.get('tempo', 0),
-                'method': result.get('method', 'unknown')
-            })
+    with ThreadPoolExecutor(max_workers=min(len(audio_files), os.cpu_count() or 1)) as pool:
+        futures = [pool.submit(extract_chord_progression_midi, file_path, tracks) for file_path in audio_files]
+        
+        for file_path, future in zip(audio_files, futures):
+            print(f"\n{'='*60}")
+            result = test_uploaded_file(file_path, tracks, result_future=future)
+            if result:
+                results.append({
+                    'file': os.path.basename(file_path),
+                    'chords': result.get('total_chords', 0),
+                    'tempo': result.get('tempo', 0),
+                    'method': result.get('method', 'unknown')
+                })
     
     # Summary
     print(f"\n{'='*60}")